@@ -5,18 +5,279 @@ Nyanpass 面板服务
 
 import os
 import json
+import logging
+import time
+import hashlib
+import html
+import hmac
 import secrets
+import threading
+import queue
+import socket
+import concurrent.futures
+from collections import deque
 from datetime import datetime, timedelta
-from flask import Flask, request, jsonify, send_from_directory, session, redirect, url_for
+from flask import Flask, Response, request, jsonify, session, redirect, url_for
+from flask.json.provider import DefaultJSONProvider
 from apscheduler.schedulers.background import BackgroundScheduler
 from apscheduler.jobstores.memory import MemoryJobStore
 from apscheduler.executors.pool import ThreadPoolExecutor
-import urllib.request
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 import urllib.parse
 import re
 import pytz
 import sys
 import ipaddress
+from functools import lru_cache
+
+try:
+    import orjson
+except ImportError:  # orjson 为可选依赖，未安装时回退到标准库 json
+    orjson = None
+
+logger = logging.getLogger("nyanpass")
+
+
+if orjson is not None:
+    json_loads = orjson.loads
+    json_dumps = orjson.dumps
+
+    def json_dumps_pretty(obj):
+        """序列化为带 2 空格缩进的 UTF-8 JSON bytes"""
+        return orjson.dumps(obj, option=orjson.OPT_INDENT_2 | orjson.OPT_NON_STR_KEYS)
+else:
+    json_loads = json.loads
+
+    def json_dumps(obj):
+        """序列化为 UTF-8 编码的 JSON bytes"""
+        return json.dumps(obj, ensure_ascii=False, separators=(",", ":")).encode('utf-8')
+
+    def json_dumps_pretty(obj):
+        """序列化为带 2 空格缩进的 UTF-8 JSON bytes"""
+        return json.dumps(obj, indent=2, ensure_ascii=False).encode('utf-8')
+
+
+class OrjsonProvider(DefaultJSONProvider):
+    """使用 orjson 序列化 jsonify 响应和解析请求体，orjson 不支持的类型交给 Flask 默认处理"""
+
+    def dumps(self, obj, **kwargs):
+        return orjson.dumps(obj, default=self.default, option=orjson.OPT_NON_STR_KEYS).decode('utf-8')
+
+    def loads(self, s, **kwargs):
+        return orjson.loads(s)
+
+
+# 同时运行的任务数上限，调度线程池与 HTTP 连接池按同一规模配置，
+# 线程按需创建，空闲时不占资源
+MAX_CONCURRENT_JOBS = 32
+# 单个任务内并发更新 DNS 记录的线程数上限
+DNS_UPDATE_WORKERS = 8
+
+# 模拟浏览器请求的公共请求头
+BROWSER_HEADERS = {
+    "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36",
+    "Accept": "application/json",
+}
+# 外部 HTTP 请求超时：(连接, 读取) 秒
+HTTP_TIMEOUT = (5, 30)
+
+# Cloudflare Zone 列表基本不会变化，缓存 24 小时
+ZONE_CACHE_TTL = 24 * 60 * 60
+# Zone 下的 A 记录列表缓存 10 分钟
+DNS_RECORDS_CACHE_TTL = 10 * 60
+# Cloudflare 表示 Zone 不存在（已删除或 ID 无效）的错误码
+CF_ZONE_NOT_FOUND_CODES = frozenset({1001, 7000, 7003})
+# 设备组（入口 IP 等）缓存时间上限 10 分钟，实际不超过任务运行间隔的一半，见 device_groups_cache_ttl
+DEVICE_GROUPS_CACHE_TTL = 10 * 60
+GiB = 1 << 30
+# 用户信息展示模板
+USER_INFO_TEMPLATE = (
+    "用户名：{username}\n"
+    "用户组：{group_name}\n"
+    "套餐：{plan_name}\n"
+    "套餐失效：{expire_str}\n"
+    "续费价格：{renew_price} 元\n"
+    "流量：{traffic_used:.2f} GiB / {traffic_enable:.2f} GiB\n"
+    "最大规则数：{max_rules}\n"
+    "速率限制：{speed_mbps} Mbps\n"
+    "钱包余额：{balance} 元"
+)
+# 相同内容的 Telegram 通知在此时间（秒）内只发送一次
+TELEGRAM_DEDUPE_WINDOW = 3600
+# 登录密码哈希格式及默认迭代次数
+PASSWORD_HASH_PREFIX = "pbkdf2_sha256$"
+PASSWORD_HASH_ITERATIONS = 200_000
+# 面板流量统计按分钟粒度更新，60 秒内重复运行直接复用
+STAT_CACHE_TTL = 60
+# 从设备组 connect_host 中提取 IPv4 地址
+IPV4_RE = re.compile(r'\b(?:[0-9]{1,3}\.){3}[0-9]{1,3}\b')
+# 规则域名校验
+DOMAIN_RE = re.compile(r'^[A-Za-z0-9](?:[A-Za-z0-9._-]{0,61}[A-Za-z0-9])?(?:\.[A-Za-z]{2,})+$')
+# 可直接用作状态文件名的任务 ID，其他 ID（含 / 或 .. 等）改用摘要作文件名
+SAFE_JOB_ID_RE = re.compile(r'[A-Za-z0-9_-]+')
+# 任务运行结果等频繁变化的字段，单独保存在 state/<job_id>.json 中，不写入 config.json
+JOB_STATE_FIELDS = ("user_info", "forward_rules", "device_groups", "last_log", "last_run")
+# 返回给前端时需要打码的任务字段及打码后的占位值；前端原样回传占位值表示未修改
+SENSITIVE_FIELDS = ("password", "cf_token", "telegram_bot_token")
+MASK = "********"
+# 设置环境变量 NYANPASS_DEBUG 时，state 文件以缩进格式写出便于查看
+DEBUG_PRETTY_JSON = bool(os.getenv("NYANPASS_DEBUG"))
+# 同样在 NYANPASS_DEBUG 下每次请求重新读取 index.html，便于修改前端后直接刷新
+DEBUG_RELOAD_INDEX = bool(os.getenv("NYANPASS_DEBUG"))
+# 设置 NYANPASS_FSYNC 时写文件后 fsync，断电也不丢最近一次写入（代价是每次写入更慢）
+FSYNC_ON_WRITE = bool(os.getenv("NYANPASS_FSYNC"))
+# 任务状态写盘的合并间隔（秒）
+STATE_FLUSH_INTERVAL = 5
+# 配置保存的合并延迟（秒），期间的多次保存只写一次盘
+CONFIG_SAVE_DELAY = 0.2
+# 延迟写盘失败后的重试间隔（秒），修改保留在内存中直到写入成功
+CONFIG_SAVE_RETRY_DELAY = 5
+# 每次运行保存的日志最多保留最后 200 行
+LAST_LOG_MAX_LINES = 200
+
+# 登录页模板，__ERROR__ 处替换为错误提示
+LOGIN_PAGE_HTML = '''
+<!DOCTYPE html>
+<html>
+<head>
+    <meta charset="utf-8">
+    <title>登录 - IEPL 配置面板</title>
+    <style>
+        body { 
+            font-family: system-ui; 
+            background: #f5f5f5; 
+            display: flex; 
+            justify-content: center; 
+            align-items: center; 
+            height: 100vh; 
+            margin: 0; 
+        }
+        .login-box { 
+            background: white; 
+            padding: 30px; 
+            border-radius: 8px; 
+            box-shadow: 0 2px 10px rgba(0,0,0,0.1); 
+            width: 320px; 
+        }
+        .login-box h2 { 
+            margin-top: 0; 
+            color: #333; 
+        }
+        input { 
+            width: 100%; 
+            padding: 10px; 
+            margin: 8px 0; 
+            border: 1px solid #ddd; 
+            border-radius: 4px; 
+            box-sizing: border-box; 
+        }
+        button { 
+            width: 100%; 
+            padding: 10px; 
+            background: #0d6efd; 
+            color: white; 
+            border: none; 
+            border-radius: 4px; 
+            cursor: pointer; 
+            font-size: 16px; 
+        }
+        button:hover { 
+            background: #0b5ed7; 
+        }
+        .error { 
+            color: #dc3545; 
+            margin: 10px 0; 
+        }
+    </style>
+</head>
+<body>
+    <div class="login-box">
+        <h2>🔐 登录</h2>
+        __ERROR__
+        <form method="post">
+            <input type="text" name="username" placeholder="用户名" required autofocus>
+            <input type="password" name="password" placeholder="密码" required>
+            <button type="submit">登录</button>
+        </form>
+    </div>
+</body>
+</html>
+'''
+# HTML 响应的完整 Content-Type，直接给出 charset，无需 Werkzeug 再根据 mimetype 拼接
+HTML_CONTENT_TYPE = "text/html; charset=utf-8"
+# 登录页静态部分预先编码，请求时只拼接错误提示
+LOGIN_PAGE_HEAD, LOGIN_PAGE_TAIL = (part.encode('utf-8') for part in LOGIN_PAGE_HTML.split("__ERROR__"))
+LOGIN_PAGE_BYTES = LOGIN_PAGE_HEAD + LOGIN_PAGE_TAIL
+
+
+def hash_password(password, iterations=PASSWORD_HASH_ITERATIONS):
+    """生成 pbkdf2_sha256$迭代次数$盐$摘要 格式的密码哈希，用于 config.json 中的 auth.password"""
+    salt = secrets.token_hex(16)
+    digest = hashlib.pbkdf2_hmac("sha256", password.encode('utf-8'), salt.encode('utf-8'), iterations)
+    return f"{PASSWORD_HASH_PREFIX}{iterations}${salt}${digest.hex()}"
+
+
+def verify_password(password, stored):
+    """
+    常量时间校验密码，stored 可以是 hash_password 生成的哈希，也可以是明文（兼容旧配置）。
+    password 或 stored 不是字符串（如手动编辑配置写成了数字）时视为校验失败。
+    """
+    if not isinstance(stored, str) or not isinstance(password or "", str):
+        return False
+    password = (password or "").encode('utf-8')
+    if not stored.startswith(PASSWORD_HASH_PREFIX):
+        return hmac.compare_digest(password, stored.encode('utf-8'))
+    try:
+        iterations, salt, digest = stored[len(PASSWORD_HASH_PREFIX):].split("$")
+        computed = hashlib.pbkdf2_hmac("sha256", password, salt.encode('utf-8'), int(iterations))
+        return hmac.compare_digest(computed.hex().encode('ascii'), digest.encode('ascii'))
+    except ValueError:
+        return False
+
+
+@lru_cache(maxsize=16)
+def get_timezone(name):
+    """获取时区对象（带缓存）"""
+    return pytz.timezone(name)
+
+
+@lru_cache(maxsize=1024)
+def format_expire_time(expire_ts_ms):
+    """将毫秒时间戳格式化为 UTC 时间字符串（带缓存，套餐到期时间很少变化）"""
+    return time.strftime("%Y/%m/%d %H:%M:%S", time.gmtime(expire_ts_ms // 1000))
+
+
+def device_groups_cache_ttl(interval_minutes):
+    """
+    设备组缓存有效期（秒）。取运行间隔的一半且不超过 DEVICE_GROUPS_CACHE_TTL，
+    缓存只在同一间隔内共用账号的任务之间复用，定时运行总能拿到上一次运行之后的设备组，
+    入口 IP 变化在下一次运行时生效。未设置定时运行（间隔 <= 0）时按上限处理。
+    """
+    if interval_minutes <= 0:
+        return DEVICE_GROUPS_CACHE_TTL
+    return min(DEVICE_GROUPS_CACHE_TTL, interval_minutes * 60 / 2)
+
+
+def cf_error_codes(response):
+    """提取 Cloudflare 错误响应中的错误码集合，响应体无法解析时返回空集合"""
+    try:
+        errors = json_loads(response.content or b"{}").get("errors") or []
+        return {error.get("code") for error in errors if isinstance(error, dict)}
+    except (ValueError, AttributeError):
+        return set()
+
+
+@lru_cache(maxsize=256)
+def extract_ipv4(connect_host):
+    """返回 connect_host 中第一个合法的 IPv4 地址，没有则返回 None（带缓存，多条规则常共用同一设备组）"""
+    for match in IPV4_RE.finditer(connect_host):
+        try:
+            return str(ipaddress.IPv4Address(match.group(0)))
+        except ipaddress.AddressValueError:
+            continue
+    return None
 
 
 class NyanpassPanel:
@@ -25,11 +286,80 @@ class NyanpassPanel:
     def __init__(self, config):
         """初始化 Nyanpass Panel 应用"""
         self.app = Flask(__name__)
+        if orjson is not None:
+            self.app.json = OrjsonProvider(self.app)
+        # API 响应不排序键、不缩进、中文不转义，减少序列化开销和响应体积
+        self.app.json.sort_keys = False
+        self.app.json.compact = True
+        self.app.json.ensure_ascii = False
         self.CONFIG_FILE = config
         self.scheduler = None
+
+        # 已解析的配置及对应文件状态 (mtime_ns, size, inode)，文件未变化时 load_config 直接返回缓存
+        self._config_cache = None
+        self._config_stat = None
+        self._config_lock = threading.RLock()
+        # 内存中的配置尚未写盘时为 True，由 _config_timer 延迟写出
+        self._config_dirty = False
+        self._config_timer = None
+
+        # 所有对外 HTTP 请求共用一个连接池，复用 keep-alive 连接避免重复 TLS 握手
+        self.http = requests.Session()
+        # 连接失败等网络错误自动重试 2 次（POST 仅在请求未发出时重试）
+        adapter = HTTPAdapter(
+            pool_connections=4,
+            pool_maxsize=MAX_CONCURRENT_JOBS,
+            pool_block=False,
+            max_retries=Retry(total=2, backoff_factor=0.2)
+        )
+        self.http.mount('https://', adapter)
+        self.http.mount('http://', adapter)
+
+        # Cloudflare Zone 列表缓存: {token 摘要: ({zone_name: zone_id}, 缓存时间)}，同 token 的任务共用
+        self._zone_cache = {}
+        # Zone 下 A 记录缓存: {(token 摘要, zone_id): ({name: record}, 缓存时间)}
+        self._records_cache = {}
+        # 流量统计缓存: {(nya_host, username): (统计数据, 缓存时间)}
+        self._stat_cache = {}
+        # 设备组缓存: {(nya_host, username): (设备组列表, 缓存时间)}
+        self._device_groups_cache = {}
+
+        # /api/config 打码后的响应体缓存: (版本号, bytes)；配置或运行状态变化时版本号递增
+        self._api_config_version = 0
+        self._api_config_cache = None
+        self._api_config_lock = threading.Lock()
+
+        # 主页 (内容, ETag)，首次访问时加载
+        self._index_page = None
+
+        # 手动触发的任务在固定大小的线程池中运行，连续点击不会无限创建线程
+        self._runner = concurrent.futures.ThreadPoolExecutor(max_workers=4, thread_name_prefix="jobrun")
+        # 每个任务一把运行锁: {job_id: Lock}，手动触发不受调度器 max_instances 限制，同一任务不并发执行
+        self._job_run_locks = {}
+        self._job_run_locks_lock = threading.Lock()
+
+        # Telegram 通知队列，由单独的后台线程发送，不阻塞任务执行
+        self._tg_queue = queue.Queue()
+        self._tg_worker = None
+        # 每个任务最近一次通知内容的摘要: {job_id: (发送时间, 摘要)}，用于抑制重复通知
+        self._tg_last_sent = {}
+
+        # 任务运行状态: 内存中保存最新值，由定时器合并后写入 state 目录
+        self.STATE_DIR = os.path.join(os.path.dirname(os.path.abspath(self.CONFIG_FILE)), "state")
+        self._job_states = {}
+        self._dirty_states = set()
+        self._state_lock = threading.Lock()
+        self._state_timer = None
         
         # 强制所有 print 输出到 stderr
         sys.stdout = sys.stderr
+        # 后台辅助方法的日志统一输出到 stderr，只在首次创建实例时配置
+        if not logger.handlers:
+            handler = logging.StreamHandler(sys.stderr)
+            handler.setFormatter(logging.Formatter("%(message)s"))
+            logger.addHandler(handler)
+            logger.setLevel(logging.INFO)
+            logger.propagate = False
 
         self.app.secret_key = secrets.token_hex(16)
         self.app.config['PERMANENT_SESSION_LIFETIME'] = timedelta(minutes=30)
@@ -62,58 +392,241 @@ class NyanpassPanel:
         return decorator
 
     def load_config(self):
-        """加载配置文件"""
-        if os.path.exists(self.CONFIG_FILE):
-            with open(self.CONFIG_FILE, 'r', encoding='utf-8') as f:
-                return json.load(f)
-        else:
-            return {"jobs": {}}
+        """
+        加载配置文件。
+        文件 (mtime_ns, size, inode) 未变化时返回同一个缓存的 dict，其他线程可能正在读取，
+        调用方不得原地修改，应复制需要改动的部分后把新 dict 交给 save_config。
+        """
+        with self._config_lock:
+            # 尚未写盘的修改以内存为准
+            if self._config_dirty:
+                return self._config_cache
+            try:
+                stat_key = self._config_stat_key()
+            except FileNotFoundError:
+                return {"jobs": {}}
+            if self._config_cache is None or stat_key != self._config_stat:
+                with open(self.CONFIG_FILE, 'rb') as f:
+                    self._config_cache = json_loads(f.read())
+                self._config_stat = stat_key
+                self._bump_api_config_version()
+            return self._config_cache
 
-    def save_config(self, config):
-        """保存配置到文件"""
+    def _config_stat_key(self):
+        """配置文件的变更标识；只比较 mtime 时，同一时间粒度内的两次写入无法区分"""
+        st = os.stat(self.CONFIG_FILE)
+        return st.st_mtime_ns, st.st_size, st.st_ino
+
+    def _bump_api_config_version(self):
+        """配置或运行状态有变化，使 /api/config 的响应缓存失效"""
+        with self._api_config_lock:
+            self._api_config_version += 1
+
+    def save_config(self, config, force=False):
+        """
+        保存配置到文件。
+        默认延迟 CONFIG_SAVE_DELAY 秒写盘，期间的多次保存合并为一次；
+        force=True 时立即写入，写入失败抛出 OSError，内存中的配置恢复为本次保存之前的状态，
+        之前尚未写盘的修改仍会由定时器继续重试。
+        """
         #if "timezone" not in config:
         #    config["timezone"] = "Asia/Shanghai"
-        with open(self.CONFIG_FILE, 'w', encoding='utf-8') as f:
-            json.dump(config, f, indent=2, ensure_ascii=False)
+        with self._config_lock:
+            previous = (self._config_cache, self._config_dirty)
+            self._config_cache = config
+            self._config_dirty = True
+            self._bump_api_config_version()
+            if not force:
+                self._schedule_config_flush(CONFIG_SAVE_DELAY)
+                return
+            self._cancel_config_flush()
+            try:
+                self.flush_config(raise_errors=True)
+            except OSError:
+                self._config_cache, self._config_dirty = previous
+                self._bump_api_config_version()
+                if self._config_dirty:
+                    self._schedule_config_flush(CONFIG_SAVE_RETRY_DELAY)
+                raise
+
+    def _schedule_config_flush(self, delay):
+        """（重新）安排 delay 秒后写盘，调用方需持有 _config_lock"""
+        self._cancel_config_flush()
+        self._config_timer = threading.Timer(delay, self.flush_config)
+        self._config_timer.daemon = True
+        self._config_timer.start()
+
+    def _cancel_config_flush(self):
+        """取消尚未执行的延迟写盘，调用方需持有 _config_lock"""
+        if self._config_timer is not None:
+            self._config_timer.cancel()
+            self._config_timer = None
+
+    def flush_config(self, raise_errors=False):
+        """
+        将尚未写盘的配置写入文件。
+        写入失败时修改保留在内存中：默认记录日志并在 CONFIG_SAVE_RETRY_DELAY 秒后重试，
+        raise_errors=True 时直接抛出 OSError，由调用方处理。
+        """
+        with self._config_lock:
+            if not self._config_dirty:
+                return
+            self._cancel_config_flush()
+            try:
+                self._write_bytes_atomic(self.CONFIG_FILE, json_dumps_pretty(self._config_cache))
+            except OSError as e:
+                if raise_errors:
+                    raise
+                logger.warning("保存配置失败 %s: %s，%s 秒后重试", self.CONFIG_FILE, e, CONFIG_SAVE_RETRY_DELAY)
+                self._schedule_config_flush(CONFIG_SAVE_RETRY_DELAY)
+                return
+            self._config_dirty = False
+            self._config_stat = self._config_stat_key()
+
+    def _write_bytes_atomic(self, path, payload):
+        """先写临时文件再 os.replace，避免进程中断时留下写了一半的文件"""
+        # 临时文件名带上进程和线程 ID，多个进程/线程同时写同一文件时互不覆盖临时文件
+        tmp_path = f"{path}.tmp.{os.getpid()}.{threading.get_ident()}"
+        # 文件含密码和令牌，仅允许属主读写
+        fd = os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        try:
+            try:
+                view = memoryview(payload)
+                while view:
+                    view = view[os.write(fd, view):]
+                if FSYNC_ON_WRITE:
+                    os.fsync(fd)
+            finally:
+                os.close(fd)
+            os.replace(tmp_path, path)
+        except OSError:
+            try:
+                os.remove(tmp_path)
+            except OSError:
+                pass
+            raise
+
+    def _write_json_atomic(self, path, data):
+        """以紧凑格式原子写出 JSON（设置 NYANPASS_DEBUG 时带缩进）"""
+        if DEBUG_PRETTY_JSON:
+            payload = json_dumps_pretty(data)
+        else:
+            payload = json_dumps(data)
+        self._write_bytes_atomic(path, payload)
+
+    def _job_state_path(self, job_id):
+        """
+        任务状态文件路径。任务 ID 来自前端提交的配置，只含字母、数字、_ 和 - 时直接作文件名，
+        否则使用 sha256 摘要，避免 "../config" 之类的 ID 读写或删除 state 目录以外的文件。
+        """
+        if SAFE_JOB_ID_RE.fullmatch(job_id):
+            name = f"{job_id}.json"
+        else:
+            # 文件名含 "."，不会与合法 ID 的文件名冲突
+            name = f"sha256.{hashlib.sha256(job_id.encode('utf-8')).hexdigest()}.json"
+        path = os.path.join(self.STATE_DIR, name)
+        if os.path.dirname(os.path.abspath(path)) != os.path.abspath(self.STATE_DIR):
+            raise ValueError(f"任务状态文件路径不在 {self.STATE_DIR} 中: {path}")
+        return path
+
+    def load_job_state(self, job_id):
+        """加载任务运行状态（用户信息、转发规则、日志等）"""
+        with self._state_lock:
+            if job_id not in self._job_states:
+                path = self._job_state_path(job_id)
+                state = {}
+                if os.path.exists(path):
+                    try:
+                        with open(path, 'rb') as f:
+                            state = json_loads(f.read())
+                    except (OSError, ValueError) as e:
+                        logger.warning("[State] 读取任务状态失败 %s: %s", path, e)
+                self._job_states[job_id] = state
+            return self._job_states[job_id]
+
+    def save_job_state(self, job_id, fields):
+        """更新任务运行状态，STATE_FLUSH_INTERVAL 秒内的多次更新合并为一次写盘"""
+        self.load_job_state(job_id)
+        with self._state_lock:
+            self._job_states[job_id] = {**self._job_states[job_id], **fields}
+            self._dirty_states.add(job_id)
+            self._bump_api_config_version()
+            if self._state_timer is None:
+                self._state_timer = threading.Timer(STATE_FLUSH_INTERVAL, self.flush_job_states)
+                self._state_timer.daemon = True
+                self._state_timer.start()
+
+    def flush_job_states(self):
+        """将有变更的任务状态写入磁盘"""
+        with self._state_lock:
+            self._state_timer = None
+            pending = {job_id: self._job_states[job_id] for job_id in self._dirty_states}
+            self._dirty_states.clear()
+        if not pending:
+            return
+        os.makedirs(self.STATE_DIR, exist_ok=True)
+        for job_id, state in pending.items():
+            try:
+                self._write_json_atomic(self._job_state_path(job_id), state)
+            except OSError as e:
+                logger.warning("[State] 保存任务状态失败 %s: %s", job_id, e)
+
+    def delete_job_state(self, job_id):
+        """删除任务运行状态"""
+        with self._state_lock:
+            self._job_states.pop(job_id, None)
+            self._dirty_states.discard(job_id)
+            self._bump_api_config_version()
+        try:
+            os.remove(self._job_state_path(job_id))
+        except FileNotFoundError:
+            pass
+
+    def migrate_job_state(self):
+        """将旧版本写在 config.json 中的运行状态字段迁移到 state 目录"""
+        config = self.load_config()
+        jobs = {}
+        migrated = False
+        for job_id, job in config.get("jobs", {}).items():
+            legacy = {field: job[field] for field in JOB_STATE_FIELDS if field in job}
+            if legacy:
+                # state 中已有的数据更新，不被旧字段覆盖
+                self.save_job_state(job_id, {**legacy, **self.load_job_state(job_id)})
+                job = {k: v for k, v in job.items() if k not in legacy}
+                migrated = True
+            jobs[job_id] = job
+        if migrated:
+            self.flush_job_states()
+            # load_config 返回的是缓存对象，写入新字典而不原地修改
+            self.save_config({**config, "jobs": jobs}, force=True)
+            logger.info("已将任务运行状态从 %s 迁移到 %s", self.CONFIG_FILE, self.STATE_DIR)
 
     def create_scheduler(self, timezone):
         """创建后台任务调度器"""
         return BackgroundScheduler(
             jobstores={'default': MemoryJobStore()},
-            executors={'default': ThreadPoolExecutor(10)},
+            executors={'default': ThreadPoolExecutor(MAX_CONCURRENT_JOBS)},
+            # 任务运行较慢时合并错过的触发、同一任务不并发执行，避免阻塞的任务占满线程池
+            job_defaults={'coalesce': True, 'max_instances': 1, 'misfire_grace_time': 60},
             timezone=timezone
         )
 
     def format_user_info(self, user_data):
         """格式化用户信息显示"""
-        username = user_data.get("username", "未知")
-        group_name = user_data.get("group_name", "未知")
-        plan_name = user_data.get("plan_name", "未知")
         expire_ts = user_data.get("expire", 0)
-        if expire_ts > 0:
-            expire_dt = datetime.utcfromtimestamp(expire_ts / 1000.0)
-            expire_str = expire_dt.strftime("%Y/%m/%d %H:%M:%S")
-        else:
-            expire_str = "永久有效"
-        renew_price = user_data.get("renew_price", "0")
-        GiB = 1024 ** 3
-        traffic_used = user_data.get("traffic_used", 0) / GiB
-        traffic_enable = user_data.get("traffic_enable", 1) / GiB
-        max_rules = user_data.get("max_rules", 0)
-        speed_bps = user_data.get("speed_limit", 0) 
-        speed_mbps = round((speed_bps / 1_000_000)*8)
-        balance = user_data.get("balance", "0")
-        return (
-            f"用户名：{username}\n"
-            f"用户组：{group_name}\n"
-            f"套餐：{plan_name}\n"
-            f"套餐失效：{expire_str}\n"
-            f"续费价格：{renew_price} 元\n"
-            f"流量：{traffic_used:.2f} GiB / {traffic_enable:.2f} GiB\n"
-            f"最大规则数：{max_rules}\n"
-            f"速率限制：{speed_mbps} Mbps\n"
-            f"钱包余额：{balance} 元"
-        )
+        speed_bps = user_data.get("speed_limit", 0)
+        return USER_INFO_TEMPLATE.format_map({
+            "username": user_data.get("username", "未知"),
+            "group_name": user_data.get("group_name", "未知"),
+            "plan_name": user_data.get("plan_name", "未知"),
+            "expire_str": format_expire_time(int(expire_ts)) if expire_ts > 0 else "永久有效",
+            "renew_price": user_data.get("renew_price", "0"),
+            "traffic_used": user_data.get("traffic_used", 0) / GiB,
+            "traffic_enable": user_data.get("traffic_enable", 1) / GiB,
+            "max_rules": user_data.get("max_rules", 0),
+            "speed_mbps": round((speed_bps / 1_000_000) * 8),
+            "balance": user_data.get("balance", "0"),
+        })
 
     def get_forward_rules(self, nya_host, token, device_groups_map):
         """获取转发规则列表"""
@@ -122,81 +635,99 @@ class NyanpassPanel:
         # 添加完整的请求头以模拟浏览器请求
         headers = {
             "Authorization": token,
-            "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36",
-            "Accept": "application/json",
+            **BROWSER_HEADERS,
             "Origin": nya_host,
             "Referer": f"{nya_host}/",
         }
-        req = urllib.request.Request(url, headers=headers)
         try:
-            with urllib.request.urlopen(req, timeout=30) as res:
-                data = json.load(res)
+            res = self.http.get(url, headers=headers, timeout=HTTP_TIMEOUT)
+            res.raise_for_status()
+            data = json_loads(res.content)
             if data.get("code") != 0:
                 raise Exception(f"获取转发规则失败: {data.get('msg', 'unknown')}")
             rules = []
+            append = rules.append
+            # 同一入口设备组下的规则很多，组名和连接地址每组只解析一次
+            group_columns = {}
+            device_groups_map = device_groups_map or {}
             for item in data.get("data", []):
-                try:
-                    config = json.loads(item.get("config", "{}"))
-                    dest_list = config.get("dest", [])
-                    dest_str = ", ".join(dest_list)
-                except:
-                    dest_str = "解析失败"
-                traffic_gib = item.get("traffic_used", 0) / (1024 ** 3)
+                config_raw = item.get("config")
+                if not config_raw:
+                    dest_str = ""
+                else:
+                    try:
+                        dest_str = ", ".join(json_loads(config_raw).get("dest", []))
+                    except (ValueError, TypeError, AttributeError):
+                        dest_str = "解析失败"
                 dgi = item.get("device_group_in")
-                device_group_info = device_groups_map.get(dgi) if device_groups_map else None
-                dgi_name = device_group_info["name"] if device_group_info else f"ID {dgi}"
-                dgi_connect = device_group_info.get("connect_host", "") if device_group_info else ""
-                rules.append({
+                columns = group_columns.get(dgi)
+                if columns is None:
+                    device_group_info = device_groups_map.get(dgi)
+                    if device_group_info:
+                        columns = (device_group_info["name"], device_group_info.get("connect_host", ""))
+                    else:
+                        columns = (f"ID {dgi}", "")
+                    group_columns[dgi] = columns
+                append({
                     "id": item["id"],
                     "name": item["name"],
                     "listen_port": item["listen_port"],
                     "dest": dest_str,
                     "status": item["status"],
-                    "traffic_gib": round(traffic_gib, 2),
+                    "traffic_gib": round(item.get("traffic_used", 0) / GiB, 2),
                     "updated_at": item.get("display_updated_at", ""),
                     "device_group_in": dgi,
-                    "device_group_name": dgi_name,
-                    "device_group_connect": dgi_connect
+                    "device_group_name": columns[0],
+                    "device_group_connect": columns[1]
                 })
             return rules
-        except urllib.error.HTTPError as e:
-            if e.code == 403:
-                error_details = e.read().decode('utf-8')
-                print(f"获取转发规则失败: HTTP 403 禁止访问，详情: {error_details}")
+        except requests.HTTPError as e:
+            if e.response.status_code == 403:
+                logger.warning("获取转发规则失败: HTTP 403 禁止访问，详情: %s", e.response.text)
                 raise Exception(f"获取转发规则失败: HTTP 403 禁止访问")
             else:
-                print(f"获取转发规则失败: HTTP {e.code} {e.reason}")
-                raise Exception(f"获取转发规则失败: HTTP {e.code} {e.reason}")
-        except Exception as e:
-            print(f"获取转发规则失败: {e}")
+                logger.warning("获取转发规则失败: HTTP %s %s", e.response.status_code, e.response.reason)
+                raise Exception(f"获取转发规则失败: HTTP {e.response.status_code} {e.response.reason}")
+        except (requests.RequestException, ValueError, KeyError) as e:
+            logger.warning("获取转发规则失败: %s", e)
             raise Exception(f"获取转发规则失败: {e}")
 
-    def get_traffic_statistic(self, nya_host, token):
-        """获取流量统计数据"""
+    def get_traffic_statistic(self, nya_host, token, username=None):
+        """
+        获取流量统计数据。
+        传入 username 时按 (nya_host, username) 缓存 STAT_CACHE_TTL 秒（token 每次登录都会变化，不适合作为键）。
+        """
+        cache_key = (nya_host, username)
+        if username is not None:
+            cached = self._stat_cache.get(cache_key)
+            if cached and time.time() - cached[1] < STAT_CACHE_TTL:
+                return cached[0]
+
         url = f"{nya_host.rstrip('/')}/api/v1/user/statistic"
         
         # 添加完整的请求头以模拟浏览器请求
         headers = {
             "Authorization": token,
-            "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36",
-            "Accept": "application/json",
+            **BROWSER_HEADERS,
             "Origin": nya_host,
             "Referer": f"{nya_host}/",
         }
-        req = urllib.request.Request(url, headers=headers)
         try:
-            with urllib.request.urlopen(req, timeout=30) as res:
-                data = json.load(res)
+            res = self.http.get(url, headers=headers, timeout=HTTP_TIMEOUT)
+            res.raise_for_status()
+            data = json_loads(res.content)
             if data.get("code") == 0:
-                return data.get("data", {})
-        except urllib.error.HTTPError as e:
-            if e.code == 403:
-                error_details = e.read().decode('utf-8')
-                print(f"[Stat] 获取流量统计失败: HTTP 403 禁止访问，详情: {error_details}")
+                stat_data = data.get("data", {})
+                if username is not None:
+                    self._stat_cache[cache_key] = (stat_data, time.time())
+                return stat_data
+        except requests.HTTPError as e:
+            if e.response.status_code == 403:
+                logger.warning("[Stat] 获取流量统计失败: HTTP 403 禁止访问，详情: %s", e.response.text)
             else:
-                print(f"[Stat] 获取流量统计失败: HTTP {e.code} {e.reason}")
-        except Exception as e:
-            print(f"[Stat] 获取流量统计失败: {e}")
+                logger.warning("[Stat] 获取流量统计失败: HTTP %s %s", e.response.status_code, e.response.reason)
+        except (requests.RequestException, ValueError, AttributeError) as e:
+            logger.warning("[Stat] 获取流量统计失败: %s", e)
         return {}
 
     def send_telegram_message(self, bot_token, chat_id, message):
@@ -215,132 +746,280 @@ class NyanpassPanel:
                 "text": message,
                 "parse_mode": "HTML"
             }
-            req = urllib.request.Request(
-                url,
-                data=json.dumps(data).encode(),
-                headers={"Content-Type": "application/json"}
-            )
-            with urllib.request.urlopen(req, timeout=30) as res:
-                result = json.load(res)
+            res = self.http.post(url, data=json_dumps(data), headers={"Content-Type": "application/json"}, timeout=15)
+            res.raise_for_status()
+            result = json_loads(res.content)
             return result.get("ok", False)
-        except Exception as e:
-            token_preview = bot_token.strip()[:10] + "..." if len(bot_token) > 10 else bot_token
-            print(f"[Telegram] 发送失败 (token预览: {token_preview}): {e}")
+        except (requests.RequestException, ValueError) as e:
+            token_preview = bot_token[:10] + "..." if len(bot_token) > 10 else bot_token
+            logger.warning("[Telegram] 发送失败 (token预览: %s): %s", token_preview, e)
             return False
 
-    def update_dns_record(self, cf_token, zone_id, name, ip):
+    def _zone_cache_key(self, cf_token, zone):
+        """生成 Zone 相关缓存键，避免在内存中以明文作为键保存 token"""
+        return (hashlib.sha256(cf_token.encode()).hexdigest()[:16], zone)
+
+    def list_zones(self, cf_token):
+        """
+        分页获取 token 可访问的全部 Zone，结果缓存 ZONE_CACHE_TTL 秒。
+        返回: ({zone_name: zone_id}, cached)
+        """
+        key = self._zone_cache_key(cf_token, None)
+        cached = self._zone_cache.get(key)
+        if cached and time.time() - cached[1] < ZONE_CACHE_TTL:
+            return cached[0], True
+
+        zones = {}
+        page = 1
+        while True:
+            query = urllib.parse.urlencode({"per_page": 50, "page": page})
+            res = self.http.get(
+                f"https://api.cloudflare.com/client/v4/zones?{query}",
+                headers={"Authorization": f"Bearer {cf_token}"},
+                timeout=HTTP_TIMEOUT
+            )
+            res.raise_for_status()
+            data = json_loads(res.content)
+            if not data.get("success"):
+                raise Exception(f"CF API Error: {data.get('errors', 'Unknown error')}")
+            for item in data.get("result", []):
+                zones[item["name"]] = item["id"]
+            if page >= data.get("result_info", {}).get("total_pages", 1):
+                break
+            page += 1
+
+        self._zone_cache[key] = (zones, time.time())
+        return zones, False
+
+    def get_zone_id(self, cf_token, hostname):
+        """
+        查询域名所属的 Cloudflare Zone，按账号下 Zone 名称做最长后缀匹配（支持 co.uk 等多级后缀）。
+        返回: (zone_name, zone_id, cached)，未找到时 zone_name 和 zone_id 为 None
+        """
+        zones, cached = self.list_zones(cf_token)
+        labels = hostname.rstrip(".").lower().split(".")
+        for i in range(len(labels) - 1):
+            zone_name = ".".join(labels[i:])
+            zone_id = zones.get(zone_name)
+            if zone_id:
+                return zone_name, zone_id, cached
+        return None, None, cached
+
+    def invalidate_zones(self, cf_token):
+        """丢弃缓存的 Zone 列表，下次运行时重新获取"""
+        self._zone_cache.pop(self._zone_cache_key(cf_token, None), None)
+
+    def list_zone_a_records(self, cf_token, zone_id):
+        """
+        分页获取 Zone 下全部 A 记录，结果缓存 DNS_RECORDS_CACHE_TTL 秒。
+        返回: {小写域名: {"id": record_id, "content": ip}}
+        """
+        key = self._zone_cache_key(cf_token, zone_id)
+        cached = self._records_cache.get(key)
+        if cached and time.time() - cached[1] < DNS_RECORDS_CACHE_TTL:
+            return cached[0]
+
+        records = {}
+        page = 1
+        while True:
+            query = urllib.parse.urlencode({"type": "A", "per_page": 100, "page": page})
+            url = f"https://api.cloudflare.com/client/v4/zones/{zone_id}/dns_records?{query}"
+            try:
+                res = self.http.get(url, headers={"Authorization": f"Bearer {cf_token}"}, timeout=HTTP_TIMEOUT)
+                res.raise_for_status()
+                data = json_loads(res.content)
+            except requests.HTTPError as e:
+                if e.response.status_code == 403:
+                    raise Exception("CF API 403 Error: Check Cloudflare Token permissions")
+                if e.response.status_code == 404 or cf_error_codes(e.response) & CF_ZONE_NOT_FOUND_CODES:
+                    # Zone 已不存在，丢弃 Zone 列表缓存以便下次重新匹配
+                    self.invalidate_zones(cf_token)
+                raise Exception(f"CF API Error {e.response.status_code}: {e.response.reason}")
+            if not data.get("success"):
+                raise Exception(f"CF API Error: {data.get('errors', 'Unknown error')}")
+            for item in data.get("result", []):
+                # 同名多条 A 记录时与逐条查询保持一致，取第一条；域名不区分大小写，统一按小写作键
+                records.setdefault(item["name"].lower(), {"id": item["id"], "content": item.get("content", "")})
+            if page >= data.get("result_info", {}).get("total_pages", 1):
+                break
+            page += 1
+
+        self._records_cache[key] = (records, time.time())
+        return records
+
+    def invalidate_zone_records(self, cf_token, zone_id):
+        """丢弃缓存的 A 记录列表，下次运行时重新获取"""
+        self._records_cache.pop(self._zone_cache_key(cf_token, zone_id), None)
+
+    def queue_telegram_message(self, bot_token, chat_id, message):
+        """将 Telegram 通知加入发送队列，首次调用时启动后台发送线程"""
+        if self._tg_worker is None or not self._tg_worker.is_alive():
+            self._tg_worker = threading.Thread(target=self._telegram_worker, name="telegram-sender", daemon=True)
+            self._tg_worker.start()
+        self._tg_queue.put((bot_token, chat_id, message))
+
+    def _telegram_worker(self):
+        """后台线程：依次发送队列中的 Telegram 通知"""
+        while True:
+            bot_token, chat_id, message = self._tg_queue.get()
+            try:
+                if self.send_telegram_message(bot_token, chat_id, message):
+                    logger.info("[Telegram] 通知已发送")
+                else:
+                    logger.warning("[Telegram] 通知发送失败")
+            finally:
+                self._tg_queue.task_done()
+
+    def update_dns_record(self, cf_token, zone_id, name, ip, record):
         """
         更新 Cloudflare DNS A 记录。
-        返回: (success: bool, message: str, changed: bool)
+        record 为 list_zone_a_records 中该域名的记录（不存在时为 None），IP 未变化时不发起任何请求。
+        返回: (success: bool, message: str, changed: bool, stale: str | None)
             - success: 操作是否成功（包括"已是最新"）
             - message: 日志信息
             - changed: IP 是否实际发生了变更（用于决定是否发通知）
+            - stale: 需要丢弃的缓存，"records" 表示记录列表已过期，"zone" 表示 Zone 已不存在，其它失败为 None
         """
         try:
-            # 查询现有 DNS 记录
-            dns_url = f"https://api.cloudflare.com/client/v4/zones/{zone_id}/dns_records?type=A&name={urllib.parse.quote(name)}"
-            dns_req = urllib.request.Request(dns_url, headers={"Authorization": f"Bearer {cf_token}"})
-            try:
-                with urllib.request.urlopen(dns_req, timeout=30) as res:
-                    dns_data = json.load(res)
-            except urllib.error.HTTPError as e:
-                if e.code == 403:
-                    return False, f"CF API 403 Error: Check Cloudflare Token permissions", False
-                else:
-                    return False, f"CF API Error {e.code}: {e.reason}", False
-            
-            if not (dns_data.get("success") and dns_data.get("result")):
-                return False, f"Could not find DNS record: {name}", False
+            if not record:
+                return False, f"Could not find DNS record: {name}", False, "records"
 
-            record = dns_data["result"][0]
             current_ip = record.get("content", "")
             
             if current_ip == ip:
-                return True, f"✓ {name} is up to date: {ip}", False
+                return True, f"✓ {name} is up to date: {ip}", False, None
 
             # IP 不同，执行更新
-            update_data = json.dumps({
+            update_data = {
                 "type": "A",
                 "name": name,
                 "content": ip,
                 "ttl": 120,
                 "proxied": False
-            }).encode()
+            }
             update_url = f"https://api.cloudflare.com/client/v4/zones/{zone_id}/dns_records/{record['id']}"
-            update_req = urllib.request.Request(
-                update_url,
-                data=update_data,
-                method="PUT",
-                headers={"Authorization": f"Bearer {cf_token}", "Content-Type": "application/json"}
-            )
             try:
-                with urllib.request.urlopen(update_req, timeout=30) as res:
-                    result = json.load(res)
-            except urllib.error.HTTPError as e:
-                if e.code == 403:
-                    return False, f"Failed to update DNS record: 403 Forbidden, check Cloudflare Token permissions", False
+                res = self.http.put(
+                    update_url,
+                    data=json_dumps(update_data),
+                    headers={"Authorization": f"Bearer {cf_token}", "Content-Type": "application/json"},
+                    timeout=HTTP_TIMEOUT
+                )
+                res.raise_for_status()
+                result = json_loads(res.content)
+            except requests.HTTPError as e:
+                if e.response.status_code == 403:
+                    return False, f"Failed to update DNS record: 403 Forbidden, check Cloudflare Token permissions", False, None
                 else:
-                    error_body = getattr(e, 'read', lambda: b'Unknown error')()
+                    error_body = e.response.content or b'Unknown error'
                     try:
-                        error_data = json.loads(error_body.decode('utf-8'))
+                        error_data = json_loads(error_body)
                         errors = str(error_data)
-                    except:
+                    except ValueError:
                         errors = str(error_body)
-                    return False, f"Failed to update DNS record: HTTP {e.code} {e.reason}, Details: {errors}", False
+                    if cf_error_codes(e.response) & CF_ZONE_NOT_FOUND_CODES:
+                        stale = "zone"
+                    elif e.response.status_code == 404:
+                        # 记录已被删除或重建，缓存的记录 ID 失效
+                        stale = "records"
+                    else:
+                        stale = None
+                    return False, f"Failed to update DNS record: HTTP {e.response.status_code} {e.response.reason}, Details: {errors}", False, stale
 
             if result.get("success"):
-                return True, f"Updated {name} -> {ip}", True
+                record["content"] = ip
+                return True, f"Updated {name} -> {ip}", True, None
             else:
                 errors = result.get("errors", "Unknown error")
-                return False, f"Update failed: {errors}", False
+                return False, f"Update failed: {errors}", False, None
 
         except Exception as e:
-            return False, f"Exception: {e}", False
-    def run_job(self, job_id, job):
+            return False, f"Exception: {e}", False, None
+    def _job_run_lock(self, job_id):
+        """获取任务的运行锁"""
+        with self._job_run_locks_lock:
+            lock = self._job_run_locks.get(job_id)
+            if lock is None:
+                lock = self._job_run_locks[job_id] = threading.Lock()
+            return lock
+
+    def run_job(self, job_id, job, refresh=False):
+        """
+        执行任务。定时运行与手动触发在不同线程池中，同一任务已在运行时跳过本次，
+        避免并发写入任务状态和重复提交 DNS 更新。
+        """
+        lock = self._job_run_lock(job_id)
+        if not lock.acquire(blocking=False):
+            logger.warning("任务 %s 正在运行，跳过本次执行", job_id)
+            return
+        try:
+            self._run_job(job_id, job, refresh)
+        finally:
+            lock.release()
+
+    def _run_job(self, job_id, job, refresh=False):
         """
         执行定时任务的主要函数
         包括登录、获取用户信息、获取转发规则、更新DNS记录等操作
+        refresh=True 时（手动触发）不使用缓存的设备组，保证入口 IP 修改后立即同步
         """
         tz = self.scheduler.timezone
-        log_lines = []
+        log_lines = deque(maxlen=LAST_LOG_MAX_LINES)
+        log_lock = threading.Lock()
+        out = sys.stderr
+        # 时间前缀按秒缓存，同一秒内的多条日志不再重复做时区转换和 strftime
+        prefix_cache = [(None, "")]
         def log(msg):
-            now = datetime.now(tz)
-            line = f"[{now.strftime('%Y-%m-%d %H:%M:%S')}] {msg}"
-            log_lines.append(line)
-            print(line)
+            second = int(time.time())
+            cached_second, prefix = prefix_cache[0]
+            if cached_second != second:
+                prefix = datetime.fromtimestamp(second, tz).strftime('[%Y-%m-%d %H:%M:%S] ')
+                prefix_cache[0] = (second, prefix)
+            line = f"{prefix}{msg}"
+            with log_lock:
+                log_lines.append(line)
+                # 逐行写入不立即 flush，任务结束时统一 flush 一次
+                out.write(line)
+                out.write("\n")
+
+        # 面板地址及公共请求头每次运行只计算一次
+        nya_host = job.get("nya_host", "https://nya.trp.sh").strip().rstrip("/")
+        device_groups_key = (nya_host, job.get("username"))
+        device_groups_ttl = device_groups_cache_ttl(job.get("interval_minutes", 15))
+        base_headers = {
+            **BROWSER_HEADERS,
+            "Origin": nya_host,
+            "Referer": f"{nya_host}/",
+        }
         try:
 
             def login(host, username, password, headers):
                 """登录面板"""
-                data = json.dumps({"username": username, "password": password}).encode()
+                data = json_dumps({"username": username, "password": password})
                 
                 # 添加更完整的浏览器样式请求头
                 full_headers = {
                     "Content-Type": "application/json",
-                    "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36",
-                    "Accept": "application/json",
-                    "Origin": job.get("nya_host", "https://nya.trp.sh").strip().rstrip("/"),
-                    "Referer": f"{job.get('nya_host', 'https://nya.trp.sh').strip().rstrip('/')}/",
+                    **base_headers,
                     **headers  # 包含原始的headers
                 }
                 
-                req = urllib.request.Request(host, data=data, headers=full_headers)
                 try:
-                    with urllib.request.urlopen(req, timeout=30) as res:
-                        response_data = res.read().decode('utf-8')
-                        response_json = json.loads(response_data)
+                    res = self.http.post(host, data=data, headers=full_headers, timeout=HTTP_TIMEOUT)
+                    res.raise_for_status()
+                    response_json = json_loads(res.content)
+                    
+                    # 检查响应是否包含错误代码
+                    if response_json.get("code") != 0:  # 假设0表示成功
+                        error_code = response_json.get("code")
+                        error_msg = response_json.get("message", "Unknown error")
+                        raise Exception(f"登录失败: API返回错误代码 {error_code} - {error_msg}")
                         
-                        # 检查响应是否包含错误代码
-                        if response_json.get("code") != 0:  # 假设0表示成功
-                            error_code = response_json.get("code")
-                            error_msg = response_json.get("message", "Unknown error")
-                            raise Exception(f"登录失败: API返回错误代码 {error_code} - {error_msg}")
-                            
-                        token = response_json["data"]
-                        return token
-                except urllib.error.HTTPError as e:
-                    if e.code == 403:
-                        error_details = e.read().decode('utf-8')
+                    token = response_json["data"]
+                    return token
+                except requests.HTTPError as e:
+                    if e.response.status_code == 403:
+                        error_details = e.response.text
                         log(f"Nyanpass面板返回HTTP 403错误，详情: {error_details}")
                         
                         # 检查是否是错误代码1010
@@ -348,30 +1027,28 @@ class NyanpassPanel:
                             raise Exception(f"登录失败: API返回错误代码1010，这通常表示访问被拒绝，可能需要启用API访问权限或存在CSRF保护")
                         else:
                             raise Exception(f"登录失败: HTTP 403 禁止访问，可能是请求被防火墙或反机器人系统拦截")
-                    elif e.code == 401:
+                    elif e.response.status_code == 401:
                         raise Exception(f"登录失败: HTTP 401 认证失败，请检查用户名和密码是否正确")
                     else:
-                        error_details = e.read().decode('utf-8')
-                        raise Exception(f"Login failed: HTTP {e.code} {e.reason}, details: {error_details}")
+                        error_details = e.response.text
+                        raise Exception(f"Login failed: HTTP {e.response.status_code} {e.response.reason}, details: {error_details}")
             
             def get_device_groups(host, token):
-                """获取设备组"""
+                """获取设备组（缓存 device_groups_ttl 秒，手动触发时不使用缓存）"""
+                cached = None if refresh else self._device_groups_cache.get(device_groups_key)
+                if cached and time.time() - cached[1] < device_groups_ttl:
+                    return cached[0]
                 try:
                     # 添加完整的请求头以模拟浏览器请求
-                    headers = {
-                        "Authorization": token,
-                        "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36",
-                        "Accept": "application/json",
-                        "Origin": job.get("nya_host", "https://nya.trp.sh").strip().rstrip("/"),
-                        "Referer": f"{job.get('nya_host', 'https://nya.trp.sh').strip().rstrip('/')}/",
-                    }
-                    req_dev = urllib.request.Request(host, headers=headers)
-                    with urllib.request.urlopen(req_dev, timeout=30) as res:
-                        dev_data = json.load(res)["data"]
+                    headers = {**base_headers, "Authorization": token}
+                    res = self.http.get(host, headers=headers, timeout=HTTP_TIMEOUT)
+                    res.raise_for_status()
+                    dev_data = json_loads(res.content)["data"]
+                    self._device_groups_cache[device_groups_key] = (dev_data, time.time())
                     return dev_data
-                except urllib.error.HTTPError as e:
-                    if e.code == 403:
-                        error_details = e.read().decode('utf-8')
+                except requests.HTTPError as e:
+                    if e.response.status_code == 403:
+                        error_details = e.response.text
                         log(f"获取设备组失败: HTTP 403 禁止访问，详情: {error_details}")
                         
                         # 检查是否是错误代码1010
@@ -380,27 +1057,21 @@ class NyanpassPanel:
                         else:
                             raise Exception(f"获取设备组失败: HTTP 403 禁止访问，API令牌可能权限不足或已过期")
                     else:
-                        error_details = e.read().decode('utf-8')
-                        raise Exception(f"获取设备组失败: HTTP {e.code} {e.reason}, details: {error_details}")
+                        error_details = e.response.text
+                        raise Exception(f"获取设备组失败: HTTP {e.response.status_code} {e.response.reason}, details: {error_details}")
 
             def get_user_info(host, token):
                 """获取用户信息"""
                 try:
                     # 添加完整的请求头以模拟浏览器请求
-                    headers = {
-                        "Authorization": token,
-                        "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36",
-                        "Accept": "application/json",
-                        "Origin": job.get("nya_host", "https://nya.trp.sh").strip().rstrip("/"),
-                        "Referer": f"{job.get('nya_host', 'https://nya.trp.sh').strip().rstrip('/')}/",
-                    }
-                    req = urllib.request.Request(host, headers=headers)
-                    with urllib.request.urlopen(req, timeout=30) as res:
-                        user_info = json.load(res)["data"]
+                    headers = {**base_headers, "Authorization": token}
+                    res = self.http.get(host, headers=headers, timeout=HTTP_TIMEOUT)
+                    res.raise_for_status()
+                    user_info = json_loads(res.content)["data"]
                     return user_info
-                except urllib.error.HTTPError as e:
-                    if e.code == 403:
-                        error_details = e.read().decode('utf-8')
+                except requests.HTTPError as e:
+                    if e.response.status_code == 403:
+                        error_details = e.response.text
                         log(f"获取用户信息失败: HTTP 403 禁止访问，详情: {error_details}")
                         
                         # 检查是否是错误代码1010
@@ -409,11 +1080,8 @@ class NyanpassPanel:
                         else:
                             raise Exception(f"获取用户信息失败: HTTP 403 禁止访问，API令牌可能权限不足或已过期")
                     else:
-                        error_details = e.read().decode('utf-8')
-                        raise Exception(f"获取用户信息失败: HTTP {e.code} {e.reason}, details: {error_details}")
-            # 获取面板地址
-            nya_host = job.get("nya_host", "https://nya.trp.sh").strip().rstrip("/")
-
+                        error_details = e.response.text
+                        raise Exception(f"获取用户信息失败: HTTP {e.response.status_code} {e.response.reason}, details: {error_details}")
             # 获取 API 路径
             api = "api/v1"
             # login 路径
@@ -430,15 +1098,16 @@ class NyanpassPanel:
                 raise Exception(f"{nya_host} 登录失败")
             log(f"{nya_host.removeprefix('https://')} 登录成功")
 
-            # 获取设备组
-            dev_data = get_device_groups(device_groups_uri, token)
-            device_groups_map = {item["id"]: item for item in dev_data}
-
-            # 获取用户信息
-            user_info = get_user_info(user_info_uri, token)
-            
-            # 获取流量统计
-            stat_data = self.get_traffic_statistic(nya_host, token)
+            # 设备组、用户信息、流量统计互不依赖，并发获取
+            with concurrent.futures.ThreadPoolExecutor(max_workers=3) as pool:
+                dev_future = pool.submit(get_device_groups, device_groups_uri, token)
+                user_future = pool.submit(get_user_info, user_info_uri, token)
+                stat_future = pool.submit(self.get_traffic_statistic, nya_host, token, job["username"])
+            dev_data = dev_future.result()
+            # 跳过缺少 id 的异常条目，避免单条脏数据导致整次运行失败
+            device_groups_map = {item["id"]: item for item in dev_data if "id" in item}
+            user_info = user_future.result()
+            stat_data = stat_future.result()
             # 今日流量统计
             traffic_today = stat_data.get("traffic_today", 0)
             # 昨日流量统计
@@ -487,30 +1156,35 @@ class NyanpassPanel:
                 for domains in rule_domains.values():
                     all_domains.extend(domains)
                 
+                # 每个域名按所属 Zone 分组，不同 Zone 的域名可以配置在同一任务中
+                domain_zones = {}
+                zone_records = {}
                 if not all_domains:
                     log("无规则域名，跳过 DNS 更新")
                 else:
-                    sample_domain = all_domains[0]
-                    parts = sample_domain.split('.')
-                    zone_name = '.'.join(parts[-2:]) if len(parts) >= 2 else sample_domain
-
                     try:
-                        zone_url = f"https://api.cloudflare.com/client/v4/zones?name={urllib.parse.quote(zone_name)}"
-                        zone_req = urllib.request.Request(zone_url, headers={"Authorization": f"Bearer {cf_token}"})
-                        with urllib.request.urlopen(zone_req, timeout=30) as res:
-                            zone_data = json.load(res)
-                        if zone_data.get("success") and zone_data["result"]:
-                            zone_id = zone_data["result"][0]["id"]
-                            log(f"Zone: {zone_name}, ID: {zone_id}")
-                        else:
-                            log(f"未找到 Zone ID for {zone_name}")
-                            zone_id = None
+                        for domain_name in dict.fromkeys(all_domains):
+                            zone_name, zone_id, cached = self.get_zone_id(cf_token, domain_name)
+                            if not zone_id:
+                                log(f"未找到 {domain_name} 所属的 Zone")
+                                continue
+                            if zone_id not in zone_records:
+                                log(f"Zone: {zone_name}, ID: {zone_id}{'（缓存）' if cached else ''}")
+                                try:
+                                    zone_records[zone_id] = self.list_zone_a_records(cf_token, zone_id)
+                                except Exception as e:
+                                    log(f"获取 {zone_name} 的 DNS 记录列表失败: {e}")
+                                    zone_records[zone_id] = None
+                            if zone_records[zone_id] is not None:
+                                domain_zones[domain_name] = zone_id
                     except Exception as e:
                         log(f"获取 Zone ID 失败: {e}")
-                        zone_id = None
 
-                if zone_id:
+                if domain_zones:
                     updated_records = []
+                    stale_record_zones = set()
+                    gone_zones = set()
+                    dns_tasks = []
                     for rule in forward_rules:
                         rule_id = str(rule["id"])
                         dgi = rule.get("device_group_in")
@@ -521,29 +1195,41 @@ class NyanpassPanel:
                             log(f"规则 {rule_id} 的设备组 {dgi} 无 connect_host，跳过")
                             continue
 
-                        # 创建正则表达式，匹配 ipv4 地址
-                        # 匹配 IPv4 地址的正则表达式
-                        ip_pattern = r'\b(?:[0-9]{1,3}\.){3}[0-9]{1,3}\b'
-                        ips = dg["connect_host"].strip()
-                        # 查找第一个匹配的ip
-                        for candidate in re.findall(ip_pattern, ips):
-                            try:
-                                rule_ip = str(ipaddress.IPv4Address(candidate))
-                                #print(str(ip))
-                                break
-                            except ipaddress.AddressValueError:
-                                continue
-                        # rule_ip = dg["connect_host"].strip()
+                        rule_ip = extract_ipv4(dg["connect_host"])
+                        if rule_ip is None:
+                            log(f"规则 {rule_id} 的设备组 {dgi} connect_host 中无 IPv4 地址，跳过")
+                            continue
                         domains = rule_domains.get(rule_id, [])
                         if not domains:
                             continue
                         log(f"规则 {rule_id} 使用 IP {rule_ip}，更新域名: {', '.join(domains)}")
-                        for domain_name in domains:
-                            success, msg, changed = self.update_dns_record(cf_token, zone_id, domain_name, rule_ip)
+                        dns_tasks.extend((domain_name, rule_ip) for domain_name in domains if domain_name in domain_zones)
+
+                    # 各域名的更新互不依赖，并发提交到 Cloudflare；结果按提交顺序记录日志
+                    if dns_tasks:
+                        with concurrent.futures.ThreadPoolExecutor(max_workers=min(DNS_UPDATE_WORKERS, len(dns_tasks))) as pool:
+                            results = list(pool.map(
+                                lambda task: self.update_dns_record(
+                                    cf_token, domain_zones[task[0]], task[0], task[1],
+                                    zone_records[domain_zones[task[0]]].get(task[0].lower())
+                                ),
+                                dns_tasks
+                            ))
+                        for (domain_name, rule_ip), (success, msg, changed, stale) in zip(dns_tasks, results):
                             log(f"  → {msg}")
+                            if stale == "zone":
+                                gone_zones.add(domain_zones[domain_name])
+                            elif stale == "records":
+                                stale_record_zones.add(domain_zones[domain_name])
                             if changed:
                                 updated_records.append((domain_name, rule_ip))
 
+                    # 记录缺失或已变更时只丢弃该 Zone 的记录缓存；Zone 本身不存在时才重新获取 Zone 列表
+                    if gone_zones:
+                        self.invalidate_zones(cf_token)
+                    for zone_id in gone_zones | stale_record_zones:
+                        self.invalidate_zone_records(cf_token, zone_id)
+
                     if updated_records and job.get("telegram_bot_token") and job.get("telegram_chat_id"):
                         tg_token = job["telegram_bot_token"]
                         tg_chat_id = job["telegram_chat_id"]
@@ -554,81 +1240,126 @@ class NyanpassPanel:
                         details = "\n".join([f"  • <code>{name}</code> → {ip}" for name, ip in items])
                         if len(unique_updates) > 10:
                             details += f"\n  • ... 等共 {len(unique_updates)} 个记录"
-                        msg = (
-                            f"⚠️ <b>IEPL DNS 已更新</b>\n"
-                            f"时间: {datetime.now(self.scheduler.timezone).strftime('%Y-%m-%d %H:%M:%S')}\n"
-                            f"详情:\n{details}"
-                        )
-                        if self.send_telegram_message(tg_token, tg_chat_id, msg):
-                            log("Telegram 通知已发送")
+                        # 消息中含时间，只按更新详情判断是否与上次通知重复
+                        digest = hashlib.blake2b(details.encode('utf-8'), digest_size=16).digest()
+                        last_ts, last_digest = self._tg_last_sent.get(job_id, (0, b""))
+                        now_ts = time.time()
+                        if digest == last_digest and now_ts - last_ts < TELEGRAM_DEDUPE_WINDOW:
+                            log("DNS 更新内容与上次通知相同，跳过 Telegram 通知")
                         else:
-                            log("Telegram 通知发送失败")
+                            msg = (
+                                f"⚠️ <b>IEPL DNS 已更新</b>\n"
+                                f"时间: {datetime.now(self.scheduler.timezone).strftime('%Y-%m-%d %H:%M:%S')}\n"
+                                f"详情:\n{details}"
+                            )
+                            self.queue_telegram_message(tg_token, tg_chat_id, msg)
+                            self._tg_last_sent[job_id] = (now_ts, digest)
+                            log("Telegram 通知已加入发送队列")
             else:
                 log("未配置 Cloudflare Token，跳过 DNS 更新")
 
-            req_logout = urllib.request.Request(
-                f"{nya_host}/api/v1/auth/logout", 
-                method="POST", 
-                headers={
-                    "Authorization": token,
-                    "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36",
-                    "Accept": "application/json",
-                    "Origin": nya_host,
-                    "Referer": f"{nya_host}/",
-                }
-            )
+            logout_headers = {**base_headers, "Authorization": token}
             try:
-                urllib.request.urlopen(req_logout, timeout=5)
+                res = self.http.post(f"{nya_host}/api/v1/auth/logout", headers=logout_headers, timeout=5)
+                res.raise_for_status()
                 log("已登出")
-            except urllib.error.HTTPError as e:
-                if e.code == 403:
+            except requests.HTTPError as e:
+                if e.response.status_code == 403:
                     log("登出失败: HTTP 403 禁止访问，可能因API令牌权限问题")
                 else:
-                    log(f"登出失败: HTTP {e.code} {e.reason}")
+                    log(f"登出失败: HTTP {e.response.status_code} {e.response.reason}")
             except Exception as e:
                 log(f"登出时出现其他错误: {str(e)}")
 
             config = self.load_config()
             if job_id in config["jobs"]:
-                config["jobs"][job_id]["user_info"] = full_user_info
-                config["jobs"][job_id]["forward_rules"] = forward_rules
-                config["jobs"][job_id]["device_groups"] = dev_data
-                config["jobs"][job_id]["last_log"] = "\n".join(log_lines)
-                config["jobs"][job_id]["last_run"] = datetime.now(tz).isoformat()
-                self.save_config(config)
+                self.save_job_state(job_id, {
+                    "user_info": full_user_info,
+                    "forward_rules": forward_rules,
+                    "device_groups": dev_data,
+                    "last_log": "\n".join(log_lines),
+                    "last_run": datetime.now(tz).isoformat(),
+                })
 
         except Exception as e:
             log(f"错误: {str(e)}")
+            # 运行失败（如令牌失效、403）时不再信任缓存的设备组
+            self._device_groups_cache.pop(device_groups_key, None)
             config = self.load_config()
             if job_id in config["jobs"]:
-                config["jobs"][job_id]["last_log"] = "\n".join(log_lines)
-                self.save_config(config)
+                self.save_job_state(job_id, {"last_log": "\n".join(log_lines)})
+        finally:
+            out.flush()
 
     def start_scheduler(self):
-        """启动任务调度器"""
+        """
+        启动任务调度器。
+        调度器已在运行且时区未变时，只对有变化的任务做增删改，不重建调度器。
+        """
         config = self.load_config()
+        self.prewarm_dns(config)
         tz_name = config.get("timezone", "Asia/Shanghai")
         try:
-            tz = pytz.timezone(tz_name)
+            tz = get_timezone(tz_name)
         except Exception:
-            tz = pytz.timezone("Asia/Shanghai")
+            tz = get_timezone("Asia/Shanghai")
         if self.scheduler is not None:
+            if self.scheduler.running and str(self.scheduler.timezone) == str(tz):
+                self.sync_scheduler_jobs(config)
+                return
             if self.scheduler.running:
                 self.scheduler.shutdown()
             self.scheduler = None
         self.scheduler = self.create_scheduler(tz)
-        for job_id, job in config.get("jobs", {}).items():
-            if job.get("enabled", True) and job.get("interval_minutes", 15) > 0:
+        self.sync_scheduler_jobs(config)
+        if not self.scheduler.running:
+            self.scheduler.start()
+
+    def prewarm_dns(self, config):
+        """在后台线程预先解析任务会访问的域名，让首次请求命中系统 DNS 缓存"""
+        hosts = {"api.cloudflare.com", "api.telegram.org"}
+        for job in config.get("jobs", {}).values():
+            hostname = urllib.parse.urlparse(job.get("nya_host", "https://nya.trp.sh").strip()).hostname
+            if hostname:
+                hosts.add(hostname)
+
+        def resolve():
+            for host in hosts:
+                try:
+                    socket.getaddrinfo(host, 443, type=socket.SOCK_STREAM)
+                except OSError:
+                    pass
+
+        threading.Thread(target=resolve, name="dns-prewarm", daemon=True).start()
+
+    def sync_scheduler_jobs(self, config):
+        """使调度器中的任务与配置一致：新增、删除、更新参数或周期"""
+        wanted = {
+            job_id: job for job_id, job in config.get("jobs", {}).items()
+            if job.get("enabled", True) and job.get("interval_minutes", 15) > 0
+        }
+        current = {job.id: job for job in self.scheduler.get_jobs()}
+
+        for job_id in current.keys() - wanted.keys():
+            self.scheduler.remove_job(job_id)
+
+        for job_id, job in wanted.items():
+            scheduled = current.get(job_id)
+            minutes = job.get("interval_minutes", 15)
+            if scheduled is None:
                 self.scheduler.add_job(
                     func=self.run_job,
                     trigger="interval",
-                    minutes=job["interval_minutes"],
+                    minutes=minutes,
                     args=[job_id, job],
                     id=job_id,
                     replace_existing=True
                 )
-        if not self.scheduler.running:
-            self.scheduler.start()
+                continue
+            if scheduled.args[1] != job:
+                scheduled.modify(args=[job_id, job])
+            if scheduled.trigger.interval != timedelta(minutes=minutes):
+                self.scheduler.reschedule_job(job_id, trigger="interval", minutes=minutes)
 
     def login(self):
         """处理用户登录请求"""
@@ -639,7 +1370,7 @@ class NyanpassPanel:
             auth_config = config.get("auth", {})
             stored_user = auth_config.get("username")
             stored_pass = auth_config.get("password")
-            if stored_user and stored_pass and username == stored_user and password == stored_pass:
+            if stored_user and stored_pass and self.check_credentials(username, password, stored_user, stored_pass):
                 session.permanent = True
                 session['logged_in'] = True
                 return redirect(url_for('index'))
@@ -650,77 +1381,20 @@ class NyanpassPanel:
                 return redirect(url_for('index'))
             return self.render_login_page()
 
+    def check_credentials(self, username, password, stored_user, stored_pass):
+        """常量时间比较用户名和密码，两项都会比较，避免通过响应时间猜测凭据；配置中的凭据不是字符串时登录失败"""
+        if not isinstance(stored_user, str):
+            return False
+        user_ok = hmac.compare_digest((username or "").encode('utf-8'), stored_user.encode('utf-8'))
+        pass_ok = verify_password(password, stored_pass)
+        return user_ok & pass_ok
+
     def render_login_page(self, error=None):
         """渲染登录页面"""
-        error_html = f'<div class="error">{error}</div>' if error else ''
-        html = f'''
-        <!DOCTYPE html>
-        <html>
-        <head>
-            <meta charset="utf-8">
-            <title>登录 - IEPL 配置面板</title>
-            <style>
-                body {{ 
-                    font-family: system-ui; 
-                    background: #f5f5f5; 
-                    display: flex; 
-                    justify-content: center; 
-                    align-items: center; 
-                    height: 100vh; 
-                    margin: 0; 
-                }}
-                .login-box {{ 
-                    background: white; 
-                    padding: 30px; 
-                    border-radius: 8px; 
-                    box-shadow: 0 2px 10px rgba(0,0,0,0.1); 
-                    width: 320px; 
-                }}
-                .login-box h2 {{ 
-                    margin-top: 0; 
-                    color: #333; 
-                }}
-                input {{ 
-                    width: 100%; 
-                    padding: 10px; 
-                    margin: 8px 0; 
-                    border: 1px solid #ddd; 
-                    border-radius: 4px; 
-                    box-sizing: border-box; 
-                }}
-                button {{ 
-                    width: 100%; 
-                    padding: 10px; 
-                    background: #0d6efd; 
-                    color: white; 
-                    border: none; 
-                    border-radius: 4px; 
-                    cursor: pointer; 
-                    font-size: 16px; 
-                }}
-                button:hover {{ 
-                    background: #0b5ed7; 
-                }}
-                .error {{ 
-                    color: #dc3545; 
-                    margin: 10px 0; 
-                }}
-            </style>
-        </head>
-        <body>
-            <div class="login-box">
-                <h2>🔐 登录</h2>
-                {error_html}
-                <form method="post">
-                    <input type="text" name="username" placeholder="用户名" required autofocus>
-                    <input type="password" name="password" placeholder="密码" required>
-                    <button type="submit">登录</button>
-                </form>
-            </div>
-        </body>
-        </html>
-        '''
-        return html
+        if not error:
+            return Response(LOGIN_PAGE_BYTES, content_type=HTML_CONTENT_TYPE)
+        error_html = f'<div class="error">{html.escape(error)}</div>'.encode('utf-8')
+        return Response(LOGIN_PAGE_HEAD + error_html + LOGIN_PAGE_TAIL, content_type=HTML_CONTENT_TYPE)
 
     def logout(self):
         """用户登出"""
@@ -728,59 +1402,116 @@ class NyanpassPanel:
         return redirect(url_for('login'))
 
     def index(self):
-        """主页路由"""
-        return send_from_directory('static', 'index.html')
+        """主页路由，页面内容与 ETag 在首次访问时读入内存，浏览器缓存未变化时返回 304"""
+        if self._index_page is None or DEBUG_RELOAD_INDEX:
+            with open(os.path.join(self.app.root_path, 'static', 'index.html'), 'rb') as f:
+                body = f.read()
+            self._index_page = (body, hashlib.blake2b(body, digest_size=8).hexdigest())
+        body, etag = self._index_page
+        response = Response(body, content_type=HTML_CONTENT_TYPE)
+        response.set_etag(etag)
+        # 页面需要登录后访问，只允许浏览器私有缓存，每次使用前用 ETag 校验
+        response.headers["Cache-Control"] = "private, no-cache"
+        return response.make_conditional(request)
 
     def get_config(self):
-        """获取配置信息 API"""
-        config = self.load_config()
-        safe_jobs = {}
-        for k, v in config.get("jobs", {}).items():
-            safe_jobs[k] = {**v}
-            if "password" in safe_jobs[k]: safe_jobs[k]["password"] = "********"
-            if "cf_token" in safe_jobs[k]: safe_jobs[k]["cf_token"] = "********"
-            if "telegram_bot_token" in safe_jobs[k]: safe_jobs[k]["telegram_bot_token"] = "********"
-        return jsonify({
+        """获取配置信息 API，配置和运行状态未变化时直接返回上次序列化的结果"""
+        # 配置与版本号在同一把锁下读取：save_config 和重新加载都在 _config_lock 内更新版本号，
+        # 之后的任何修改都会使版本号大于这里取到的值，本次生成的响应不会被当作新版本缓存
+        with self._config_lock:
+            config = self.load_config()
+            version = self._api_config_version
+        cached = self._api_config_cache
+        if cached is not None and cached[0] == version:
+            return Response(cached[1], mimetype="application/json")
+        # 一次遍历完成合并运行状态与敏感字段打码，空值不打码；
+        # 空的 rule_domains 不返回，前端缺省按空处理
+        safe_jobs = {
+            k: {
+                field: MASK if field in SENSITIVE_FIELDS and value else value
+                for field, value in {**v, **self.load_job_state(k)}.items()
+                if value or field != "rule_domains"
+            }
+            for k, v in config.get("jobs", {}).items()
+        }
+        body = json_dumps({
             "auth": {
                 "username": config.get("auth", {}).get("username", ""),
-                "password": "********" if config.get("auth", {}).get("password") else ""
+                "password": MASK if config.get("auth", {}).get("password") else ""
             },
             "timezone": config.get("timezone", "Asia/Shanghai"),
             "jobs": safe_jobs
         })
+        # 构建期间若有更新，版本号已变化，下次请求会重新生成
+        self._api_config_cache = (version, body)
+        return Response(body, mimetype="application/json")
+
+    def _json_body(self):
+        """直接用 json_loads 解析请求体（不依赖 Content-Type），格式错误或不是对象时返回 None"""
+        raw = request.get_data(cache=False)
+        if not raw:
+            return None
+        try:
+            data = json_loads(raw)
+        except ValueError:
+            return None
+        return data if isinstance(data, dict) else None
 
     def update_config(self):
         """更新配置信息 API"""
-        data = request.json
+        data = self._json_body()
         if not data:
             return jsonify({"error": "Invalid JSON"}), 400
-        config = self.load_config()
+        old_config = self.load_config()
+        # 在副本上修改，便于与当前配置比较；load_config 返回的是共享缓存
+        config = {**old_config}
         if "auth" in data:
-            config["auth"] = data["auth"]
+            auth = data["auth"]
+            if not isinstance(auth, dict):
+                return jsonify({"error": "auth must be an object"}), 400
+            if any(not isinstance(auth.get(field, ""), str) for field in ("username", "password")):
+                return jsonify({"error": "auth username and password must be strings"}), 400
+            password = auth.get("password")
+            if password == MASK:
+                auth["password"] = old_config.get("auth", {}).get("password", "")
+            elif password and not password.startswith(PASSWORD_HASH_PREFIX):
+                # 新设置的登录密码只以哈希形式落盘
+                auth["password"] = hash_password(password)
+            config["auth"] = auth
         if "timezone" in data:
             config["timezone"] = data["timezone"]
         
-        orig_jobs = config.get("jobs", {})
+        orig_jobs = old_config.get("jobs", {})
         new_jobs = {}
         for job_id, job in data.get("jobs", {}).items():
             orig_job = orig_jobs.get(job_id, {})
             
             # 恢复敏感字段
-            if job.get("password") == "********":
-                job["password"] = orig_job.get("password", "")
-            if job.get("cf_token") == "********":
-                job["cf_token"] = orig_job.get("cf_token", "")
-            if job.get("telegram_bot_token") == "********":
-                job["telegram_bot_token"] = orig_job.get("telegram_bot_token", "")
+            for field in SENSITIVE_FIELDS:
+                if job.get(field) == MASK:
+                    job[field] = orig_job.get(field, "")
             
             #  关键修复：始终保留 rule_domains（不管前端是否发送）
             job["rule_domains"] = orig_job.get("rule_domains", {})
+
+            # 运行状态由 state 文件维护，前端回传的副本不写入配置
+            for field in JOB_STATE_FIELDS:
+                job.pop(field, None)
             
             new_jobs[job_id] = job
         
         config["jobs"] = new_jobs
-        self.save_config(config)
-        self.start_scheduler()
+        # 前端常整表回传未修改的配置，内容相同时不写盘也不调整调度器
+        if config == old_config:
+            return jsonify({"status": "unchanged"})
+        try:
+            self.save_config(config, force=True)
+        except OSError as e:
+            return jsonify({"error": f"保存配置失败: {e}"}), 500
+        for job_id in orig_jobs.keys() - new_jobs.keys():
+            self.delete_job_state(job_id)
+        if new_jobs != orig_jobs or config.get("timezone") != old_config.get("timezone"):
+            self.start_scheduler()
         return jsonify({"status": "saved"})
 
     def trigger_run(self, job_id):
@@ -788,9 +1519,10 @@ class NyanpassPanel:
         config = self.load_config()
         if job_id not in config.get("jobs", {}):
             return jsonify({"error": "Job not found"}), 404
+        if self._job_run_lock(job_id).locked():
+            return jsonify({"error": "Job is already running"}), 409
         job = config["jobs"][job_id]
-        import threading
-        threading.Thread(target=self.run_job, args=(job_id, job)).start()
+        self._runner.submit(self.run_job, job_id, job, refresh=True)
         return jsonify({"status": "started"})
 
     def manage_rule_domains(self, job_id, rule_id):
@@ -800,46 +1532,64 @@ class NyanpassPanel:
             return jsonify({"error": "Job not found"}), 404
         
         job = config["jobs"][job_id]
-        if "rule_domains" not in job or not isinstance(job["rule_domains"], dict):
-            job["rule_domains"] = {}
-            self.save_config(config)
         
         if request.method == 'GET':
-            rule_domains = job.get("rule_domains", {})
+            # 只读请求不修正、不写盘，rule_domains 缺失或格式不对时按空处理
+            rule_domains = job.get("rule_domains")
             if not isinstance(rule_domains, dict):
                 rule_domains = {}
-                job["rule_domains"] = rule_domains
-                self.save_config(config)
-            domains = rule_domains.get(rule_id, [])
-            return jsonify({"domains": domains})
+            return jsonify({"domains": rule_domains.get(rule_id, [])})
         
         elif request.method == 'POST':
-            data = request.json
+            data = self._json_body()
             if not data or "domains" not in data:
                 return jsonify({"error": "Invalid data"}), 400
             domains = data["domains"]
             if not isinstance(domains, list):
                 return jsonify({"error": "domains must be a list"}), 400
-            domain_re = re.compile(r'^[A-Za-z0-9](?:[A-Za-z0-9._-]{0,61}[A-Za-z0-9])?(?:\.[A-Za-z]{2,})+$')
-            invalid = [d for d in domains if not isinstance(d, str) or not domain_re.match(d)]
-            if invalid:
-                return jsonify({"error": "invalid domains", "invalid": invalid}), 400
+            # 先检查数量再逐个校验，超长列表无需跑完正则
             if len(domains) > 500:
                 return jsonify({"error": "too many domains"}), 400
-            if not isinstance(job.get("rule_domains"), dict):
-                job["rule_domains"] = {}
-            job["rule_domains"][rule_id] = domains
-            self.save_config(config)
+            # 一次遍历完成校验和保序去重，重复的域名只匹配一次正则；
+            # DNS 记录按小写域名匹配，只有大小写不同的域名视为重复，保留第一次出现的写法
+            match = DOMAIN_RE.match
+            seen = {}
+            invalid = []
+            for d in domains:
+                if not isinstance(d, str):
+                    invalid.append(d)
+                    continue
+                key = d.lower()
+                if key not in seen:
+                    if match(d):
+                        seen[key] = d
+                    else:
+                        invalid.append(d)
+            if invalid:
+                return jsonify({"error": "invalid domains", "invalid": invalid}), 400
+            domains = list(seen.values())
+            rule_domains = job.get("rule_domains")
+            if not isinstance(rule_domains, dict):
+                rule_domains = {}
+            self.save_config(self._with_rule_domains(config, job_id, {**rule_domains, rule_id: domains}))
             return jsonify({"status": "saved", "domains": domains})
         
         elif request.method == 'DELETE':
-            if not isinstance(job.get("rule_domains"), dict):
-                job["rule_domains"] = {}
-            if rule_id in job["rule_domains"]:
-                del job["rule_domains"][rule_id]
-                self.save_config(config)
+            rule_domains = job.get("rule_domains")
+            if isinstance(rule_domains, dict) and rule_id in rule_domains:
+                rule_domains = {k: v for k, v in rule_domains.items() if k != rule_id}
+                self.save_config(self._with_rule_domains(config, job_id, rule_domains))
             return jsonify({"status": "deleted"})
 
+    @staticmethod
+    def _with_rule_domains(config, job_id, rule_domains):
+        """
+        返回替换了指定任务 rule_domains 的新配置。load_config 返回的是缓存对象，
+        run_job 可能正在其他线程遍历其中的 rule_domains，因此只复制不原地修改。
+        """
+        job = {**config["jobs"][job_id], "rule_domains": rule_domains}
+        return {**config, "jobs": {**config["jobs"], job_id: job}}
+
     def initialize_config(self):
         """初始化配置文件"""
         # 判断配置文件是否存在，不存在则初始化
@@ -849,7 +1599,6 @@ class NyanpassPanel:
             initial_password = secrets.token_urlsafe(16)
             # 默认时区
             timezone = "Asia/Shanghai"
-            print(f"  未找到 {self.CONFIG_FILE}，已创建初始配置文件 {self.CONFIG_FILE}，请修改 auth 部分后重启！")
             initial_config = {
                 "auth": {
                 "username": initial_username,
@@ -858,17 +1607,39 @@ class NyanpassPanel:
                 "timezone": timezone,
                 "jobs": {}
             }
-            self.save_config(initial_config)
-            print(" 已创建初始配置文件 config.json，请修改 auth 部分后重启！")
+            self.save_config(initial_config, force=True)
+            logger.warning("未找到 %s，已创建初始配置文件，请修改 auth 部分后重启！", self.CONFIG_FILE)
+
+    def serve(self, host, port):
+        """
+        启动 HTTP 服务。
+        默认使用 waitress 多线程 WSGI 服务器；设置 NYANPASS_DEV 或未安装 waitress 时使用 Flask 开发服务器。
+        """
+        if not os.getenv("NYANPASS_DEV"):
+            try:
+                from waitress import serve
+            except ImportError:
+                logger.warning("未安装 waitress，使用 Flask 开发服务器")
+            else:
+                serve(self.app, host=host, port=port, threads=8, ident=None)
+                return
+        self.app.run(host=host, port=port, debug=False, use_reloader=False)
 
     def run(self):
         """运行应用"""
         self.initialize_config()
+        self.migrate_job_state()
         self.start_scheduler()
         try:
-            self.app.run(host='0.0.0.0', port=5000, debug=False, use_reloader=False)
+            self.serve(host='0.0.0.0', port=5000)
         except KeyboardInterrupt:
-            print("Shutting down...")
+            logger.info("Shutting down...")
         finally:
             if self.scheduler is not None and self.scheduler.running:
                 self.scheduler.shutdown()
+            self._runner.shutdown(wait=False)
+            try:
+                self.flush_config(raise_errors=True)
+            except OSError as e:
+                logger.error("退出前保存配置失败，未写盘的修改已丢失 %s: %s", self.CONFIG_FILE, e)
+            self.flush_job_states()
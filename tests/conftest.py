@@ -0,0 +1,116 @@
+"""测试公共夹具：使用临时配置文件创建面板，外部 HTTP 请求由 FakeAdapter 按路由应答"""
+import json
+import os
+import re
+import sys
+
+import pytest
+import requests
+from requests.adapters import BaseAdapter
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "src"))
+
+from nyanpass_panel.app import NyanpassPanel, get_timezone  # noqa: E402
+
+ADMIN_USER = "admin"
+ADMIN_PASSWORD = "secret"
+
+
+class FakeAdapter(BaseAdapter):
+    """按 (方法, URL 正则) 路由返回预设响应，并记录收到的请求，测试中不访问网络"""
+
+    def __init__(self):
+        super().__init__()
+        self.routes = []
+        self.calls = []
+
+    def route(self, method, pattern, handler):
+        """注册路由，handler(request) 返回 (状态码, JSON 响应体)"""
+        self.routes.insert(0, (method, re.compile(pattern), handler))
+
+    def send(self, request, **kwargs):
+        self.calls.append((request.method, request.url))
+        status, body = 404, {"success": False, "errors": [{"code": 7003, "message": "no route"}]}
+        for method, pattern, handler in self.routes:
+            if method == request.method and pattern.search(request.url):
+                status, body = handler(request)
+                break
+        response = requests.Response()
+        response.status_code = status
+        response.reason = "OK" if status < 400 else "Error"
+        response._content = json.dumps(body).encode("utf-8")
+        response.url = request.url
+        response.request = request
+        return response
+
+    def close(self):
+        pass
+
+
+@pytest.fixture
+def config_data():
+    """默认配置，测试可在创建 panel 前修改"""
+    return {
+        "auth": {"username": ADMIN_USER, "password": ADMIN_PASSWORD},
+        "timezone": "Asia/Shanghai",
+        "jobs": {
+            "j1": {
+                "name": "job",
+                "username": "nya-user",
+                "password": "nya-pass",
+                "nya_host": "https://nya.test",
+                "cf_token": "cf-token",
+                "interval_minutes": 15,
+                "enabled": True,
+                "telegram_bot_token": "",
+                "telegram_chat_id": "",
+                "rule_domains": {"10": ["a.example.com"]},
+            }
+        },
+    }
+
+
+@pytest.fixture
+def fake_http():
+    return FakeAdapter()
+
+
+@pytest.fixture
+def panel(tmp_path, config_data, fake_http):
+    """使用临时目录中的 config.json 创建面板，调度器只创建不启动"""
+    config_file = tmp_path / "config.json"
+    config_file.write_text(json.dumps(config_data), encoding="utf-8")
+    panel = NyanpassPanel(str(config_file))
+    panel.http.mount("https://", fake_http)
+    panel.http.mount("http://", fake_http)
+    panel.scheduler = panel.create_scheduler(get_timezone(config_data["timezone"]))
+    yield panel
+    if panel.scheduler is not None and panel.scheduler.running:
+        panel.scheduler.shutdown(wait=False)
+    panel.flush_config()
+
+
+@pytest.fixture
+def client(panel):
+    """已登录的测试客户端"""
+    client = panel.app.test_client()
+    response = client.post("/login", data={"username": ADMIN_USER, "password": ADMIN_PASSWORD})
+    assert response.status_code == 302
+    return client
+
+
+def cf_page(result):
+    """单页的 Cloudflare 列表响应"""
+    return 200, {"success": True, "result": result, "result_info": {"page": 1, "total_pages": 1}}
+
+
+def route_panel_api(fake_http, connect_host="5.6.7.8"):
+    """注册 run_job 用到的面板接口：登录、登出、用户信息、流量统计、设备组和一条使用设备组 1 的规则 10"""
+    fake_http.route("POST", r"nya\.test/.*login", lambda request: (200, {"code": 0, "data": "TOKEN"}))
+    fake_http.route("POST", r"nya\.test/.*logout", lambda request: (200, {"code": 0}))
+    fake_http.route("GET", r"nya\.test/.*/user/info", lambda request: (200, {"code": 0, "data": {"username": "u"}}))
+    fake_http.route("GET", r"nya\.test/.*/user/statistic", lambda request: (200, {"code": 0, "data": {}}))
+    fake_http.route("GET", r"nya\.test/.*/user/devicegroup", lambda request: (
+        200, {"code": 0, "data": [{"id": 1, "name": "dg", "connect_host": connect_host}]}))
+    fake_http.route("GET", r"nya\.test/.*/user/forward", lambda request: (
+        200, {"code": 0, "data": [{"id": 10, "name": "r", "listen_port": 1, "status": "ok", "device_group_in": 1}]}))
@@ -0,0 +1,61 @@
+"""登录密码哈希与凭据校验"""
+import pytest
+
+from nyanpass_panel.app import PASSWORD_HASH_PREFIX, hash_password, verify_password
+
+
+def test_hash_password_round_trip():
+    stored = hash_password("p@ss 密码", iterations=1000)
+    assert stored.startswith(PASSWORD_HASH_PREFIX)
+    assert verify_password("p@ss 密码", stored)
+    assert not verify_password("p@ss", stored)
+    assert not verify_password("", stored)
+    assert not verify_password(None, stored)
+
+
+def test_hash_password_uses_random_salt():
+    assert hash_password("same", iterations=1000) != hash_password("same", iterations=1000)
+
+
+def test_verify_password_accepts_legacy_plaintext():
+    assert verify_password("plain", "plain")
+    assert not verify_password("Plain", "plain")
+    assert verify_password(None, "")
+
+
+@pytest.mark.parametrize("stored", [
+    PASSWORD_HASH_PREFIX,
+    PASSWORD_HASH_PREFIX + "1000$salt",
+    PASSWORD_HASH_PREFIX + "1000$salt$abc$extra",
+    PASSWORD_HASH_PREFIX + "many$salt$abc",
+    PASSWORD_HASH_PREFIX + "0$salt$abc",
+    PASSWORD_HASH_PREFIX + "1000$salt$摘要",
+])
+def test_verify_password_rejects_malformed_hash(stored):
+    assert not verify_password("anything", stored)
+
+
+@pytest.mark.parametrize("password, stored", [
+    ("123", 123),
+    ("", None),
+    ("x", ["x"]),
+    (123, "123"),
+])
+def test_verify_password_rejects_non_string(password, stored):
+    assert not verify_password(password, stored)
+
+
+def test_check_credentials(panel):
+    stored = hash_password("secret", iterations=1000)
+    assert panel.check_credentials("admin", "secret", "admin", stored)
+    assert not panel.check_credentials("admin", "wrong", "admin", stored)
+    assert not panel.check_credentials("other", "secret", "admin", stored)
+    assert not panel.check_credentials("admin", "secret", 1, stored)
+    assert not panel.check_credentials("admin", "secret", "admin", 1)
+
+
+def test_login_with_non_string_stored_password(panel):
+    config = panel.load_config()
+    panel.save_config({**config, "auth": {"username": "admin", "password": 123}}, force=True)
+    response = panel.app.test_client().post("/login", data={"username": "admin", "password": "123"})
+    assert response.status_code == 200
@@ -0,0 +1,53 @@
+"""Cloudflare Zone 匹配与 A 记录查找"""
+import json
+
+from conftest import cf_page, route_panel_api
+
+
+def test_get_zone_id_longest_suffix_match(panel, monkeypatch):
+    zones = {"example.com": "Z1", "example.co.uk": "Z2", "sub.example.com": "Z3", "co.uk": "Z4"}
+    monkeypatch.setattr(panel, "list_zones", lambda cf_token: (zones, True))
+    assert panel.get_zone_id("cf", "a.example.com") == ("example.com", "Z1", True)
+    assert panel.get_zone_id("cf", "example.com") == ("example.com", "Z1", True)
+    assert panel.get_zone_id("cf", "x.sub.example.com") == ("sub.example.com", "Z3", True)
+    assert panel.get_zone_id("cf", "A.Example.Co.UK.") == ("example.co.uk", "Z2", True)
+    assert panel.get_zone_id("cf", "other.uk") == (None, None, True)
+    # 只有顶级域时不会匹配到 "com" 这样的后缀
+    assert panel.get_zone_id("cf", "com") == (None, None, True)
+
+
+def test_list_zone_a_records_keys_by_lowercase_name(panel, fake_http):
+    fake_http.route("GET", r"/zones/Z1/dns_records", lambda request: cf_page([
+        {"id": "r1", "name": "b.example.com", "content": "1.1.1.1"},
+        {"id": "r2", "name": "b.example.com", "content": "2.2.2.2"},
+        {"id": "r3", "name": "C.Example.com", "content": "3.3.3.3"},
+    ]))
+    records = panel.list_zone_a_records("cf", "Z1")
+    assert records == {
+        "b.example.com": {"id": "r1", "content": "1.1.1.1"},
+        "c.example.com": {"id": "r3", "content": "3.3.3.3"},
+    }
+
+
+def test_run_job_updates_mixed_case_domain(panel, fake_http):
+    """用户填写的域名大小写与 Cloudflare 返回的不一致时，仍更新已有记录而不是报告记录不存在"""
+    puts = []
+
+    def put_record(request):
+        body = json.loads(request.body)
+        puts.append((request.url, body["name"], body["content"]))
+        return 200, {"success": True, "result": {}}
+
+    route_panel_api(fake_http)
+    fake_http.route("GET", r"api\.cloudflare\.com/client/v4/zones\?", lambda request: cf_page(
+        [{"id": "Z1", "name": "example.com"}]))
+    fake_http.route("GET", r"/zones/Z1/dns_records", lambda request: cf_page(
+        [{"id": "r1", "name": "b.example.com", "content": "1.1.1.1"}]))
+    fake_http.route("PUT", r"/zones/Z1/dns_records/r1", put_record)
+
+    config = panel.load_config()
+    job = {**config["jobs"]["j1"], "rule_domains": {"10": ["B.Example.com"]}}
+    panel.save_config({**config, "jobs": {"j1": job}}, force=True)
+    panel.run_job("j1", job)
+
+    assert puts == [("https://api.cloudflare.com/client/v4/zones/Z1/dns_records/r1", "B.Example.com", "5.6.7.8")]
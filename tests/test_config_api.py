@@ -0,0 +1,111 @@
+"""配置接口：敏感字段打码回填、未修改检测与参数校验"""
+import json
+import os
+import threading
+
+import pytest
+
+from nyanpass_panel.app import MASK, PASSWORD_HASH_PREFIX, verify_password
+
+
+def saved_config(panel):
+    panel.flush_config()
+    with open(panel.CONFIG_FILE, encoding="utf-8") as f:
+        return json.load(f)
+
+
+def test_new_password_is_hashed(panel, client):
+    data = client.get("/api/config").get_json()
+    data["auth"]["password"] = "new-secret"
+    assert client.post("/api/config", json=data).get_json() == {"status": "saved"}
+    stored = saved_config(panel)["auth"]["password"]
+    assert stored.startswith(PASSWORD_HASH_PREFIX)
+    assert verify_password("new-secret", stored)
+
+
+def test_masked_auth_password_kept(panel, client):
+    data = client.get("/api/config").get_json()
+    assert data["auth"]["password"] == MASK
+    data["auth"]["username"] = "root"
+    assert client.post("/api/config", json=data).get_json() == {"status": "saved"}
+    assert saved_config(panel)["auth"] == {"username": "root", "password": "secret"}
+
+
+@pytest.mark.parametrize("auth", [
+    "admin",
+    ["admin"],
+    {"password": 123},
+    {"username": ["admin"], "password": MASK},
+    {"username": "admin", "password": {"x": 1}},
+])
+def test_invalid_auth_rejected(panel, client, auth):
+    before = panel.load_config()
+    response = client.post("/api/config", json={"auth": auth})
+    assert response.status_code == 400
+    assert panel.load_config() is before
+
+
+def test_get_config_masks_sensitive_fields(client):
+    data = client.get("/api/config").get_json()
+    assert data["auth"]["password"] == MASK
+    job = data["jobs"]["j1"]
+    assert job["password"] == MASK
+    assert job["cf_token"] == MASK
+    # 空值不打码，前端据此区分"未设置"和"已设置"
+    assert job["telegram_bot_token"] == ""
+
+
+def test_masked_fields_restored_on_save(panel, client):
+    data = client.get("/api/config").get_json()
+    data["jobs"]["j1"]["name"] = "renamed"
+    response = client.post("/api/config", json=data)
+    assert response.get_json() == {"status": "saved"}
+
+    job = saved_config(panel)["jobs"]["j1"]
+    assert job["name"] == "renamed"
+    assert job["password"] == "nya-pass"
+    assert job["cf_token"] == "cf-token"
+    assert job["telegram_bot_token"] == ""
+    # 前端不回传 rule_domains，保存后仍保留原值
+    assert job["rule_domains"] == {"10": ["a.example.com"]}
+
+
+def test_posting_config_back_unchanged(panel, client):
+    before = panel.load_config()
+    mtime = os.stat(panel.CONFIG_FILE).st_mtime_ns
+    data = client.get("/api/config").get_json()
+    response = client.post("/api/config", json=data)
+    assert response.get_json() == {"status": "unchanged"}
+    assert panel.load_config() is before
+    assert os.stat(panel.CONFIG_FILE).st_mtime_ns == mtime
+    # 配置未变化时不重建调度器
+    assert not panel.scheduler.running
+
+
+@pytest.mark.parametrize("body", [b"", b"{not json", b"[]", b'"text"'])
+@pytest.mark.parametrize("url", ["/api/config", "/api/domains/j1/10"])
+def test_malformed_json_rejected(client, url, body):
+    response = client.post(url, data=body, content_type="application/json")
+    assert response.status_code == 400
+    assert response.is_json
+
+
+def test_get_config_cache_not_stale_after_concurrent_save(panel, client, monkeypatch):
+    """生成响应期间另一线程保存了配置，下一次请求必须返回新配置"""
+    load_config = panel.load_config
+    saver = []
+
+    def load_then_save_elsewhere():
+        config = load_config()
+        if not saver:
+            renamed = {**config, "jobs": {"j1": {**config["jobs"]["j1"], "name": "renamed"}}}
+            saver.append(threading.Thread(target=panel.save_config, args=(renamed,)))
+            saver[0].start()
+            # 另一线程的保存在读取配置与版本号之间完成（或因锁等待到本次读取结束）
+            saver[0].join(0.2)
+        return config
+
+    monkeypatch.setattr(panel, "load_config", load_then_save_elsewhere)
+    assert client.get("/api/config").get_json()["jobs"]["j1"]["name"] == "job"
+    saver[0].join()
+    assert client.get("/api/config").get_json()["jobs"]["j1"]["name"] == "renamed"
@@ -0,0 +1,102 @@
+"""配置延迟写盘：合并写入、失败重试与立即保存失败时的回滚"""
+import errno
+import json
+import time
+
+import pytest
+
+from nyanpass_panel import app as app_module
+
+
+@pytest.fixture(autouse=True)
+def short_delays(monkeypatch):
+    monkeypatch.setattr(app_module, "CONFIG_SAVE_DELAY", 0.05)
+    monkeypatch.setattr(app_module, "CONFIG_SAVE_RETRY_DELAY", 0.05)
+
+
+@pytest.fixture
+def writes(panel, monkeypatch):
+    """记录配置写盘次数；把 fail 设为 True 时模拟磁盘已满"""
+    write = panel._write_bytes_atomic
+    state = {"count": 0, "fail": False}
+
+    def counting_write(path, payload):
+        if path == panel.CONFIG_FILE:
+            if state["fail"]:
+                raise OSError(errno.ENOSPC, "No space left on device")
+            state["count"] += 1
+        write(path, payload)
+
+    monkeypatch.setattr(panel, "_write_bytes_atomic", counting_write)
+    return state
+
+
+def on_disk(panel):
+    with open(panel.CONFIG_FILE, encoding="utf-8") as f:
+        return json.load(f)
+
+
+def renamed(config, name):
+    return {**config, "jobs": {"j1": {**config["jobs"]["j1"], "name": name}}}
+
+
+def wait_until(predicate, timeout=2):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        if predicate():
+            return True
+        time.sleep(0.01)
+    return predicate()
+
+
+def test_saves_within_delay_write_once(panel, writes):
+    config = panel.load_config()
+    panel.save_config(renamed(config, "a"))
+    panel.save_config(renamed(config, "b"))
+    # 写盘前读取的是内存中的最新配置
+    assert panel.load_config()["jobs"]["j1"]["name"] == "b"
+    assert on_disk(panel)["jobs"]["j1"]["name"] == "job"
+
+    assert wait_until(lambda: on_disk(panel)["jobs"]["j1"]["name"] == "b")
+    time.sleep(0.1)
+    assert writes["count"] == 1
+
+
+def test_failed_timer_write_is_retried(panel, writes):
+    writes["fail"] = True
+    panel.save_config(renamed(panel.load_config(), "a"))
+    time.sleep(0.2)
+    assert on_disk(panel)["jobs"]["j1"]["name"] == "job"
+    assert panel.load_config()["jobs"]["j1"]["name"] == "a"
+
+    writes["fail"] = False
+    assert wait_until(lambda: on_disk(panel)["jobs"]["j1"]["name"] == "a")
+
+
+def test_failed_forced_save_keeps_pending_edits(panel, client, writes):
+    response = client.post("/api/domains/j1/11", json={"domains": ["b.example.com"]})
+    assert response.get_json()["status"] == "saved"
+
+    writes["fail"] = True
+    data = client.get("/api/config").get_json()
+    data["jobs"]["j1"]["name"] = "renamed"
+    response = client.post("/api/config", json=data)
+    assert response.status_code == 500
+
+    # 本次修改未生效，之前已返回 saved 的域名修改仍在内存中
+    config = panel.load_config()
+    assert config["jobs"]["j1"]["name"] == "job"
+    assert config["jobs"]["j1"]["rule_domains"]["11"] == ["b.example.com"]
+
+    writes["fail"] = False
+    assert wait_until(lambda: "11" in on_disk(panel)["jobs"]["j1"]["rule_domains"])
+    assert on_disk(panel)["jobs"]["j1"]["name"] == "job"
+
+
+def test_failed_forced_save_without_pending_edits(panel, writes):
+    before = panel.load_config()
+    writes["fail"] = True
+    with pytest.raises(OSError):
+        panel.save_config(renamed(before, "a"), force=True)
+    assert panel.load_config() is before
+    assert not panel._config_dirty
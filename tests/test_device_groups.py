@@ -0,0 +1,56 @@
+"""设备组缓存：同一运行间隔内共用账号的任务复用，跨运行和手动触发时重新获取"""
+import pytest
+
+from conftest import route_panel_api
+from nyanpass_panel.app import DEVICE_GROUPS_CACHE_TTL, device_groups_cache_ttl
+
+
+@pytest.mark.parametrize("interval_minutes, ttl", [
+    (1, 30),
+    (5, 150),
+    (15, 450),
+    (60, DEVICE_GROUPS_CACHE_TTL),
+    (0, DEVICE_GROUPS_CACHE_TTL),
+])
+def test_device_groups_cache_ttl(interval_minutes, ttl):
+    assert device_groups_cache_ttl(interval_minutes) == ttl
+
+
+@pytest.mark.parametrize("interval_minutes", [1, 5, 15, 30, 60, 1440])
+def test_device_groups_cache_never_outlives_interval(interval_minutes):
+    """上一次定时运行获取的设备组距本次运行约一个间隔，必须已过期"""
+    assert device_groups_cache_ttl(interval_minutes) < interval_minutes * 60
+
+
+def device_group_fetches(fake_http):
+    return sum(1 for method, url in fake_http.calls if url.endswith("/user/devicegroup"))
+
+
+@pytest.fixture
+def job(panel, fake_http):
+    route_panel_api(fake_http)
+    config = panel.load_config()
+    # 不配置 Cloudflare，只验证面板请求
+    return {**config["jobs"]["j1"], "cf_token": ""}
+
+
+def test_cache_hit_within_half_interval(panel, fake_http, job):
+    panel.run_job("j1", job)
+    panel.run_job("j1", job)
+    assert device_group_fetches(fake_http) == 1
+
+
+def test_cache_miss_after_half_interval(panel, fake_http, job):
+    panel.run_job("j1", job)
+    key = next(iter(panel._device_groups_cache))
+    data, fetched_at = panel._device_groups_cache[key]
+    ttl = device_groups_cache_ttl(job["interval_minutes"])
+    panel._device_groups_cache[key] = (data, fetched_at - ttl - 1)
+    panel.run_job("j1", job)
+    assert device_group_fetches(fake_http) == 2
+
+
+def test_manual_run_bypasses_cache(panel, fake_http, job):
+    panel.run_job("j1", job)
+    panel.run_job("j1", job, refresh=True)
+    assert device_group_fetches(fake_http) == 2
@@ -0,0 +1,78 @@
+"""任务运行状态文件的读写、迁移与删除"""
+import json
+import os
+
+import pytest
+
+
+def read_json(path):
+    with open(path, encoding="utf-8") as f:
+        return json.load(f)
+
+
+def test_save_and_reload_job_state(panel):
+    panel.save_job_state("j1", {"last_log": "a"})
+    panel.save_job_state("j1", {"last_run": "b"})
+    panel.flush_job_states()
+    path = os.path.join(panel.STATE_DIR, "j1.json")
+    assert read_json(path) == {"last_log": "a", "last_run": "b"}
+    # 状态不写入 config.json
+    assert "last_log" not in read_json(panel.CONFIG_FILE)["jobs"]["j1"]
+
+    panel._job_states.clear()
+    assert panel.load_job_state("j1") == {"last_log": "a", "last_run": "b"}
+
+
+def test_removed_job_state_deleted(panel, client):
+    panel.save_job_state("j1", {"last_log": "a"})
+    panel.flush_job_states()
+    path = os.path.join(panel.STATE_DIR, "j1.json")
+    assert os.path.exists(path)
+    assert client.post("/api/config", json={"jobs": {}}).get_json() == {"status": "saved"}
+    assert not os.path.exists(path)
+    assert panel.load_job_state("j1") == {}
+
+
+@pytest.mark.parametrize("job_id", ["../config", "a/b", "..", "x.y", "任务"])
+def test_unsafe_job_id_stays_in_state_dir(panel, client, job_id):
+    path = panel._job_state_path(job_id)
+    assert os.path.dirname(path) == panel.STATE_DIR
+    assert path != panel._job_state_path("other")
+
+    panel.save_job_state(job_id, {"last_log": "x"})
+    panel.flush_job_states()
+    assert read_json(path) == {"last_log": "x"}
+
+    # 删除任务只删除 state 目录中的文件，不影响 config.json
+    data = client.get("/api/config").get_json()
+    data["jobs"][job_id] = {"name": "n", "enabled": False}
+    assert client.post("/api/config", json=data).get_json() == {"status": "saved"}
+    data["jobs"].pop(job_id)
+    assert client.post("/api/config", json=data).get_json() == {"status": "saved"}
+    assert not os.path.exists(path)
+    assert read_json(panel.CONFIG_FILE)["jobs"].keys() == {"j1"}
+
+
+def test_migrate_legacy_state_fields(panel):
+    config = panel.load_config()
+    legacy_job = {**config["jobs"]["j1"], "last_log": "old log", "last_run": "old run", "forward_rules": [1]}
+    panel.save_config({**config, "jobs": {"j1": legacy_job}}, force=True)
+    # state 中已有的字段比 config.json 中的旧字段新，迁移时保留
+    panel.save_job_state("j1", {"last_run": "new run"})
+    panel.flush_job_states()
+
+    panel.migrate_job_state()
+
+    job = read_json(panel.CONFIG_FILE)["jobs"]["j1"]
+    assert not {"last_log", "last_run", "forward_rules"} & job.keys()
+    assert job["cf_token"] == "cf-token"
+    assert read_json(os.path.join(panel.STATE_DIR, "j1.json")) == {
+        "last_log": "old log", "last_run": "new run", "forward_rules": [1],
+    }
+
+
+def test_migrate_without_legacy_fields_does_not_write(panel):
+    mtime = os.stat(panel.CONFIG_FILE).st_mtime_ns
+    panel.migrate_job_state()
+    assert os.stat(panel.CONFIG_FILE).st_mtime_ns == mtime
+    assert not os.path.exists(panel.STATE_DIR)
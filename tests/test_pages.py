@@ -0,0 +1,23 @@
+"""主页响应：登录校验、ETag 与 304"""
+
+
+def test_index_requires_login(panel):
+    response = panel.app.test_client().get("/")
+    assert response.status_code == 302
+
+
+def test_index_etag_and_304(client):
+    response = client.get("/")
+    assert response.status_code == 200
+    assert response.headers["Content-Type"] == "text/html; charset=utf-8"
+    assert response.headers["Cache-Control"] == "private, no-cache"
+    etag = response.headers["ETag"]
+    assert etag and response.data
+
+    cached = client.get("/", headers={"If-None-Match": etag})
+    assert cached.status_code == 304
+    assert cached.data == b""
+
+    stale = client.get("/", headers={"If-None-Match": '"other"'})
+    assert stale.status_code == 200
+    assert stale.data == response.data
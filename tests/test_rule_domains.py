@@ -0,0 +1,31 @@
+"""规则域名接口：校验、去重与读写"""
+import pytest
+
+
+def post_domains(client, domains, rule_id="11"):
+    return client.post(f"/api/domains/j1/{rule_id}", json={"domains": domains})
+
+
+def test_domains_deduplicated_case_insensitively(panel, client):
+    response = post_domains(client, ["b.example.com", "B.example.com", "c.example.com", "b.EXAMPLE.com", "c.example.com"])
+    assert response.get_json() == {"status": "saved", "domains": ["b.example.com", "c.example.com"]}
+    assert panel.load_config()["jobs"]["j1"]["rule_domains"]["11"] == ["b.example.com", "c.example.com"]
+
+
+def test_first_spelling_kept(client):
+    response = post_domains(client, ["B.Example.com", "b.example.com"])
+    assert response.get_json()["domains"] == ["B.Example.com"]
+
+
+@pytest.mark.parametrize("domains", [["not a domain"], ["b.example.com", 1], "b.example.com"])
+def test_invalid_domains_rejected(panel, client, domains):
+    before = panel.load_config()
+    assert post_domains(client, domains).status_code == 400
+    assert panel.load_config() is before
+
+
+def test_get_and_delete_domains(panel, client):
+    assert client.get("/api/domains/j1/10").get_json() == {"domains": ["a.example.com"]}
+    assert client.delete("/api/domains/j1/10").get_json() == {"status": "deleted"}
+    assert client.get("/api/domains/j1/10").get_json() == {"domains": []}
+    assert client.get("/api/domains/missing/10").status_code == 404
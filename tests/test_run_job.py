@@ -0,0 +1,50 @@
+"""任务执行：同一任务不并发运行"""
+import threading
+
+from conftest import route_panel_api
+
+
+def test_run_job_skips_when_already_running(panel, fake_http, monkeypatch):
+    started = threading.Event()
+    release = threading.Event()
+    runs = []
+
+    def slow_run(job_id, job, refresh=False):
+        runs.append(job_id)
+        started.set()
+        release.wait(2)
+
+    monkeypatch.setattr(panel, "_run_job", slow_run)
+    job = panel.load_config()["jobs"]["j1"]
+    worker = threading.Thread(target=panel.run_job, args=("j1", job))
+    worker.start()
+    assert started.wait(2)
+
+    # 同一任务再次执行直接跳过，其他任务不受影响
+    panel.run_job("j1", job, refresh=True)
+    release.set()
+    panel.run_job("j2", job)
+    worker.join(2)
+    assert runs == ["j1", "j2"]
+
+    # 上一次运行结束后可以再次执行
+    panel.run_job("j1", job)
+    assert runs == ["j1", "j2", "j1"]
+
+
+def test_trigger_run_rejects_running_job(panel, client):
+    lock = panel._job_run_lock("j1")
+    lock.acquire()
+    try:
+        response = client.post("/api/run/j1")
+        assert response.status_code == 409
+    finally:
+        lock.release()
+    assert client.post("/api/run/missing").status_code == 404
+
+
+def test_trigger_run_runs_job(panel, client, fake_http):
+    route_panel_api(fake_http)
+    assert client.post("/api/run/j1").get_json() == {"status": "started"}
+    panel._runner.shutdown(wait=True)
+    assert panel.load_job_state("j1")["last_run"]
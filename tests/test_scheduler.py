@@ -0,0 +1,62 @@
+"""调度器任务与配置同步：只增删改有变化的任务"""
+from datetime import timedelta
+
+import pytest
+
+
+@pytest.fixture
+def scheduler(panel):
+    # 暂停状态下启动，任务只登记不执行
+    panel.scheduler.start(paused=True)
+    return panel.scheduler
+
+
+def jobs_config(panel, **jobs):
+    return {**panel.load_config(), "jobs": jobs}
+
+
+def base_job(**fields):
+    return {"name": "n", "interval_minutes": 15, "enabled": True, **fields}
+
+
+def test_sync_adds_enabled_jobs_only(panel, scheduler):
+    panel.sync_scheduler_jobs(jobs_config(
+        panel,
+        a=base_job(),
+        b=base_job(enabled=False),
+        c=base_job(interval_minutes=0),
+        d={"name": "no interval"},
+    ))
+    jobs = {job.id: job for job in scheduler.get_jobs()}
+    assert jobs.keys() == {"a", "d"}
+    assert jobs["a"].trigger.interval == timedelta(minutes=15)
+    # 未填写周期时按默认 15 分钟
+    assert jobs["d"].trigger.interval == timedelta(minutes=15)
+
+
+def test_sync_keeps_unchanged_job(panel, scheduler):
+    panel.sync_scheduler_jobs(jobs_config(panel, a=base_job()))
+    next_run = scheduler.get_job("a").next_run_time
+    panel.sync_scheduler_jobs(jobs_config(panel, a=base_job()))
+    assert scheduler.get_job("a").next_run_time == next_run
+
+
+def test_sync_updates_args_without_rescheduling(panel, scheduler):
+    panel.sync_scheduler_jobs(jobs_config(panel, a=base_job()))
+    next_run = scheduler.get_job("a").next_run_time
+    panel.sync_scheduler_jobs(jobs_config(panel, a=base_job(name="renamed")))
+    job = scheduler.get_job("a")
+    assert job.args[1]["name"] == "renamed"
+    assert job.next_run_time == next_run
+
+
+def test_sync_reschedules_changed_interval(panel, scheduler):
+    panel.sync_scheduler_jobs(jobs_config(panel, a=base_job()))
+    panel.sync_scheduler_jobs(jobs_config(panel, a=base_job(interval_minutes=5)))
+    assert scheduler.get_job("a").trigger.interval == timedelta(minutes=5)
+
+
+def test_sync_removes_deleted_and_disabled_jobs(panel, scheduler):
+    panel.sync_scheduler_jobs(jobs_config(panel, a=base_job(), b=base_job()))
+    panel.sync_scheduler_jobs(jobs_config(panel, a=base_job(enabled=False)))
+    assert scheduler.get_jobs() == []